@@ -0,0 +1,389 @@
+"""
+The module implement a Vercel Serverlesss Function for bulk administration of
+the token table and the subscriptions.
+
+A request is a JSON batch of operations:
+
+    POST /api/admin
+    Authorization: Bearer <ADMIN_KEY>
+
+    {"dry_run": false,
+     "operations": [
+        {"op": "add", "client": "Andy", "token": "TOKEN_OF_ANDY"},
+        {"op": "rename", "client": "Bob", "new": "Bobby"},
+        {"op": "remove", "clients": ["Cindy", "Dan"]},
+        {"op": "set_topics", "client": "Andy", "topics": ["IT", "#AI"]}]}
+
+The whole batch is applied with one load of each file, and each file is
+saved once only if an operation has changed it (with the optimistic locking
+of gdrive). The versions of all changed files are checked before the first
+save, so a batch conflicting with another writer saves nothing; if a save
+still fails (409), the files saved before are listed in the response. The
+response has the result of each operation and whether each file is saved.
+"""
+__author__ = "York <york.jong@gmail.com>"
+__date__ = "2026/10/19 (initial version) ~ 2026/10/19 (last revision)"
+
+__all__ = [
+    'handler',
+    'apply_operations',
+]
+
+import os
+import sys
+import hmac
+import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+if __name__ == '__main__':
+    sys.path.append('../src')
+else:
+    # on Vercel environment
+    sys.path.append(os.path.join(os.getcwd(), 'src'))
+
+import timing
+from subscribe_page import start_loads
+
+
+TOKENS = 'access_tokens.yml'
+DAILY = 'subscriptions_Daily.yml'
+WEEKLY = 'subscriptions_Weekly.yml'
+
+
+#------------------------------------------------------------------------------
+# Operations
+#------------------------------------------------------------------------------
+
+def _str(op, key):
+    '''Get a string argument of an operation.
+
+    Args:
+        op (dict): the operation.
+        key (str): the name of the argument.
+
+    Returns:
+        (str): the argument.
+
+    Raises:
+        KeyError: if the argument is missing.
+        ValueError: if the argument is not a non-empty string.
+    '''
+    value = op[key]
+    if not isinstance(value, str) or not value:
+        raise ValueError(f'{key} must be a non-empty string')
+    return value
+
+
+def _strs(op, key):
+    '''Get a string-list argument of an operation.
+
+    Args:
+        op (dict): the operation.
+        key (str): the name of the argument.
+
+    Returns:
+        ([str]): the argument.
+
+    Raises:
+        KeyError: if the argument is missing.
+        ValueError: if the argument is not a list of strings.
+    '''
+    value = op[key]
+    if not isinstance(value, list) or \
+            not all(isinstance(x, str) for x in value):
+        raise ValueError(f'{key} must be a list of strings')
+    return value
+
+
+def _add(op, tbl, subs_d, subs_w):
+    client, token = _str(op, 'client'), _str(op, 'token')
+    if token in tbl.tokens():
+        return {'client': tbl.client(token)}, set()
+    name = tbl.add_item(token, client)
+    return {'client': name}, {TOKENS}
+
+
+def _rename(op, tbl, subs_d, subs_w):
+    old, new = _str(op, 'client'), _str(op, 'new')
+    if old not in tbl.clients():
+        raise ValueError(f'unknown client: {old}')
+    if new in tbl.clients():
+        raise ValueError(f'client exists: {new}')
+    # an orphaned subscription of the new name would make the rename of
+    # the subscriptions a no-op
+    for fn, subs in ((DAILY, subs_d), (WEEKLY, subs_w)):
+        if new in subs.clients():
+            raise ValueError(f'client exists in {fn}: {new}')
+    changed = {TOKENS}
+    tbl.rename(old, new)
+    for fn, subs in ((DAILY, subs_d), (WEEKLY, subs_w)):
+        if old in subs.clients():
+            subs.rename(old, new)
+            changed.add(fn)
+    return {'client': new}, changed
+
+
+def _remove(op, tbl, subs_d, subs_w):
+    clients = _strs(op, 'clients') if 'clients' in op else \
+        [_str(op, 'client')]
+    changed = set()
+    removed = set()
+    for fn, table in ((TOKENS, tbl), (DAILY, subs_d), (WEEKLY, subs_w)):
+        found = set(clients) & set(table.clients())
+        if found:
+            table.remove_clients(list(found))
+            changed.add(fn)
+            removed |= found
+    return {'removed': [c for c in clients if c in removed]}, changed
+
+
+def _set_topics(op, tbl, subs_d, subs_w):
+    client, topics = _str(op, 'client'), _strs(op, 'topics')
+    if client not in tbl.clients():
+        raise ValueError(f'unknown client: {client}')
+    daily = subs_d.subscribable_topics()
+    weekly = subs_w.subscribable_topics()
+    unknown = [t for t in topics if t not in daily and t not in weekly]
+    if unknown:
+        raise ValueError(f'unknown topics: {unknown}')
+    topics_daily = [t for t in topics if t not in weekly]
+    topics_weekly = [t for t in topics if t in weekly]
+    changed = set()
+    for fn, subs, new in ((DAILY, subs_d, topics_daily),
+                          (WEEKLY, subs_w, topics_weekly)):
+        if sorted(new) != sorted(subs.topics(client)):
+            subs.update_topics(client, new)
+            changed.add(fn)
+    return {'client': client}, changed
+
+
+# map an operation to its function, which applies it to the tables, and
+# returns its result and the set of files changed.
+OPERATIONS = {
+    'add': _add,
+    'rename': _rename,
+    'remove': _remove,
+    'set_topics': _set_topics,
+}
+
+
+def apply_operations(ops, tbl, subs_d, subs_w):
+    '''Apply a batch of operations to the loaded tables.
+
+    Operations are applied in order; an invalid operation fails without
+    changing the tables, and the others are still applied.
+
+    Args:
+        ops ([dict]): the operations; each has "op" (a key of OPERATIONS)
+            and its arguments.
+        tbl (TokenTable): the token table.
+        subs_d (Subscriptions): the daily subscriptions.
+        subs_w (Subscriptions): the weekly subscriptions.
+
+    Returns:
+        ([dict], set): the result of each operation ("ok", and "error" or
+            the result of the operation), and the set of files changed.
+    '''
+    results = []
+    changed = set()
+    for i, op in enumerate(ops):
+        name = op.get('op') if isinstance(op, dict) else None
+        result = {'index': i, 'op': name}
+        if name not in OPERATIONS:
+            result.update(ok=False, error=f'unknown operation: {name}')
+        else:
+            try:
+                out, files = OPERATIONS[name](op, tbl, subs_d, subs_w)
+            except KeyError as e:
+                result.update(ok=False, error=f'missing argument: {e}')
+            except (ValueError, TypeError) as e:
+                result.update(ok=False, error=str(e))
+            else:
+                result.update(ok=True, **out)
+                changed |= files
+        results.append(result)
+    return results, changed
+
+
+#------------------------------------------------------------------------------
+# handler of the Vercel serverless function
+#------------------------------------------------------------------------------
+
+class handler(timing.ServerTimingMixin, BaseHTTPRequestHandler):
+    '''handler of the Vercel Serverless Function.
+
+    Note: The class name must be handler.
+    '''
+
+    def _send_json(self, code, obj):
+        '''Send a JSON response.
+
+        Args:
+            code (int): the status code (e.g., 200, 400, 409) to send.
+            obj (Any): the Python object to send as JSON.
+        '''
+        self.send_response(code)
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(obj, ensure_ascii=False).encode())
+
+    def _is_authorized(self):
+        '''Check the bearer token of the request against $ADMIN_KEY.
+
+        Returns:
+            (bool): True if authorized; always False if $ADMIN_KEY is unset.
+        '''
+        key = os.environ.get('ADMIN_KEY', '')
+        auth = self.headers.get('Authorization', '')
+        if not key or not auth.startswith('Bearer '):
+            return False
+        return hmac.compare_digest(auth[len('Bearer '):].encode(),
+                                   key.encode())
+
+    def do_POST(self):
+        if not self._is_authorized():
+            self._send_json(401, {'error': 'unauthorized'})
+            return
+
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            batch = json.loads(self.rfile.read(content_length) or b'{}')
+            ops = batch['operations']
+            if not isinstance(ops, list):
+                raise ValueError
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {'error': 'invalid batch'})
+            return
+        dry_run = bool(batch.get('dry_run', False))
+
+        with timing.phase('drive-load'), \
+                ThreadPoolExecutor(max_workers=3) as pool:
+            f_tbl, f_subs_d, f_subs_w = start_loads(pool)
+            tables = {TOKENS: f_tbl.result(), DAILY: f_subs_d.result(),
+                      WEEKLY: f_subs_w.result()}
+
+        with timing.phase('apply'):
+            results, changed = apply_operations(
+                ops, tables[TOKENS], tables[DAILY], tables[WEEKLY])
+
+        code, body = self._save(tables, changed, dry_run)
+        body.update(dry_run=dry_run, results=results)
+        self._send_json(code, body)
+
+    @staticmethod
+    def _save(tables, changed, dry_run):
+        '''Save the changed tables.
+
+        The versions of all changed tables are checked before the first
+        save, so a conflict with another writer saves nothing; a save which
+        still fails stops the others.
+
+        Args:
+            tables ({str: _Table}): map filename to its table.
+            changed (set): filenames of the changed tables.
+            dry_run (bool): True to save nothing.
+
+        Returns:
+            (int, dict): the status code (200 or 409), and the body with
+                "saved" (map filename to True if saved) and "error" (if
+                failed).
+        '''
+        saved = {fn: False for fn in tables}
+        todo = [fn for fn in tables if fn in changed]
+        if dry_run or not todo:
+            return 200, {'saved': saved}
+        with timing.phase('drive-check'):
+            stale = [fn for fn in todo if not tables[fn].is_current()]
+        if stale:
+            return 409, {'saved': saved,
+                         'error': f'updated by someone else: {stale}'}
+        for fn in todo:
+            try:
+                with timing.phase('drive-save'):
+                    tables[fn].save()
+            except Exception as e:
+                return 409, {'saved': saved, 'error': f'{fn}: {e}'}
+            saved[fn] = True
+        return 200, {'saved': saved}
+
+
+#------------------------------------------------------------------------------
+# Test
+#------------------------------------------------------------------------------
+
+def test_apply_operations():
+    import gdrive
+    from gdrive import TokenTable, Subscriptions
+    files = {
+        TOKENS: ({'Andy': 'TA', 'Bob': 'TB', 'Cindy': 'TC'}, '1'),
+        DAILY: ([[['IT'], ['Andy', 'Cindy']], [['Finance'], ['Bob']]], '1'),
+        WEEKLY: ([[['Technology'], ['Andy', 'Orphan']]], '1'),
+    }
+    ops = [
+        {'op': 'add', 'client': 'Andy', 'token': 'TD'},
+        {'op': 'rename', 'client': 'Bob', 'new': 'Bobby'},
+        {'op': 'remove', 'clients': 'Cindy'},
+        {'op': 'remove', 'clients': [['x']]},
+        {'op': 'remove', 'client': ['x']},
+        {'op': 'add', 'client': None, 'token': 'TE'},
+        {'op': 'set_topics', 'client': 'Andy', 'topics': 'IT'},
+        {'op': 'set_topics', 'client': 'Andy', 'topics': ['Technology']},
+        {'op': 'remove', 'clients': ['Cindy', 'Dan']},
+        {'op': 'rename', 'client': 'Andy'},
+        ['x'],
+        {'op': 'rename', 'client': 'Andy', 'new': 'Orphan'},
+    ]
+    with gdrive._memory_drive(files) as drive:
+        tbl = TokenTable(TOKENS)
+        subs_d, subs_w = Subscriptions(DAILY), Subscriptions(WEEKLY)
+        results, changed = apply_operations(ops, tbl, subs_d, subs_w)
+        tables = {TOKENS: tbl, DAILY: subs_d, WEEKLY: subs_w}
+
+        # nothing is saved if a changed file has been updated by others
+        data, version = files[DAILY]
+        files[DAILY] = (data, '2')
+        code, body = handler._save(tables, changed, False)
+        assert code == 409 and not any(body['saved'].values())
+        assert files[TOKENS][1] == '1'
+
+        # a failed save lists the files saved before
+        files[DAILY] = (data, version)
+        save_YAML = drive.save_YAML
+        def fail_daily(data, filename, version=None):
+            if filename == DAILY:
+                raise Exception('The file has been updated by someone else.')
+            save_YAML(data, filename, version)
+        drive.save_YAML = fail_daily
+        code, body = handler._save(tables, changed, False)
+        assert code == 409 and body['saved'] == {
+            TOKENS: True, DAILY: False, WEEKLY: False}, body
+    assert [r['ok'] for r in results] == [
+        True, True, False, False, False, False, False, True, True, False,
+        False, False], results
+    assert results[0]['client'] == 'Andy_1'
+    assert results[2]['error'] == 'clients must be a list of strings'
+    assert results[8]['removed'] == ['Cindy']
+    assert results[9]['error'] == "missing argument: 'new'"
+    assert results[11]['error'] == f'client exists in {WEEKLY}: Orphan'
+    assert changed == {TOKENS, DAILY}
+    assert tbl._table == {'Andy': 'TA', 'Bobby': 'TB', 'Andy_1': 'TD'}
+    assert subs_d.topics('Andy') == [] and subs_w.topics('Andy') == [
+        'Technology']
+    print('OK')
+
+
+def test():
+    # Start the HTTP server on port 8080
+    server_address = ('', 8080)
+    httpd = HTTPServer(server_address, handler)
+    print('Starting server...')
+    httpd.serve_forever()
+
+
+if __name__ == '__main__':
+    import mock_mode
+    mock_mode.init_environ_variables()
+
+    test_apply_operations()
+    test()
@@ -2,52 +2,207 @@
 The module implement a Vercel Serverlesss Function to authorize Line Notify.
 """
 __author__ = "York <york.jong@gmail.com>"
-__date__ = "2023/05/04 (initial version) ~ 2023/05/10 (last revision)"
+__date__ = "2023/05/04 (initial version) ~ 2026/10/19 (last revision)"
 
 __all__ = [
     'handler',
+    'make_state',
+    'verify_state',
 ]
 
 import os
+import sys
+import time
+import hmac
+import hashlib
 import secrets
+from http.cookies import SimpleCookie
 from urllib.parse import parse_qs
 from http.server import BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
+if __name__ == '__main__':
+    sys.path.append('../src')
+else:
+    # on Vercel environment
+    sys.path.append(os.path.join(os.getcwd(), 'src'))
+
+import timing
+from line import token_status
+from subscribe_page import start_loads, resolve_name, SubscriptionPage
+
 HOME_URL = "https://news-digest-line.vercel.app"
 REDIRECT_URI = f"{HOME_URL}/api/oauth"
 
+STATE_TTL = 600     # lifetime (in seconds) of an OAuth state
+NONCE_COOKIE = 'oauth_nonce'    # the cookie binding a state to the browser
+
+
+#------------------------------------------------------------------------------
+# OAuth State
+#------------------------------------------------------------------------------
+
+def _state_key():
+    '''Derive the key to sign OAuth states from the client secret.
+
+    Returns:
+        (bytes): the key.
+    '''
+    return hmac.new(os.environ['CLIENT_SECRET'].encode(),
+                    b'news-digest-line/oauth-state', hashlib.sha256).digest()
 
-class handler(BaseHTTPRequestHandler):
+
+def _sign(payload):
+    return hmac.new(_state_key(), payload.encode(), hashlib.sha256).hexdigest()
+
+
+def make_state():
+    '''Make a signed OAuth state.
+
+    The state is "<nonce>.<timestamp>.<signature>", where the signature is an
+    HMAC over the nonce and the timestamp. Any instance can verify it without
+    shared storage.
+
+    Returns:
+        (str): the state.
+    '''
+    payload = f'{secrets.token_hex(16)}.{int(time.time())}'
+    return f'{payload}.{_sign(payload)}'
+
+
+def verify_state(state, ttl=STATE_TTL, nonce=None):
+    '''Verify a signed OAuth state.
+
+    A signed state alone is a bearer value, which can be replayed within its
+    lifetime (e.g., in a login CSRF); binding it to the browser by the nonce
+    (kept in a cookie by the authorization request) prevents that.
+
+    Args:
+        state (str): the state made by make_state.
+        ttl (int): the lifetime of the state in seconds.
+        nonce (str): the nonce bound to the browser; the nonce of the state
+            must equal it if specified.
+
+    Returns:
+        (bool): True if the state is authentic, not expired, and of the
+            nonce; False otherwise.
+    '''
+    try:
+        state_nonce, timestamp, signature = state.split('.')
+        age = time.time() - int(timestamp)
+        # compare bytes; compare_digest rejects non-ASCII str
+        if not hmac.compare_digest(
+                signature.encode(),
+                _sign(f'{state_nonce}.{timestamp}').encode()):
+            return False
+        if nonce is not None and \
+                not hmac.compare_digest(state_nonce.encode(), nonce.encode()):
+            return False
+    except (ValueError, TypeError):
+        # UnicodeError is a ValueError
+        return False
+    return 0 <= age <= ttl
+
+
+def _nonce_cookie(nonce, max_age=STATE_TTL):
+    '''Format the Set-Cookie value of the nonce of a state.
+
+    The callback of LINE is a cross-site POST (form_post), so the cookie must
+    be SameSite=None (and thus Secure).
+
+    Args:
+        nonce (str): the nonce; an empty one with max_age 0 clears the cookie.
+        max_age (int): the lifetime of the cookie in seconds.
+
+    Returns:
+        (str): the value of the Set-Cookie header.
+    '''
+    return (f'{NONCE_COOKIE}={nonce}; Max-Age={max_age}; Path=/api/oauth; '
+            'HttpOnly; Secure; SameSite=None')
+
+
+#------------------------------------------------------------------------------
+# handler of the Vercel serverless function
+#------------------------------------------------------------------------------
+
+
+class handler(timing.ServerTimingMixin, BaseHTTPRequestHandler):
     '''handler of the Vercel Serverless Function.
 
     Note: The class name must be handler.
     '''
 
-    def _redirect_to(self, url):
+    def _redirect_to(self, url, cookie=None):
         '''Redirect to a given URL.
 
         Args:
             url (str): the URL that redirect to
+            cookie (str): the value of a Set-Cookie header to send, if any.
         '''
         self.send_response(302)
         self.send_header('Location', url)
+        if cookie:
+            self.send_header('Set-Cookie', cookie)
+        self.end_headers()
+
+    def _send_error(self, err_code, err_msg):
+        '''Send a error page.
+
+        Args:
+            err_code (int): error code (e.g., 401, 423) to send.
+            err_msg (str): error message to send.
+        '''
+        self.send_response(err_code)
+        self.end_headers()
+        self.wfile.write(err_msg.encode())
+
+    def _send_html(self, html):
+        '''Send a normal (code 200) HTML page.
+
+        Args:
+            html (str): a HTML string to send.
+        '''
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html')
         self.end_headers()
+        self.wfile.write(html.encode())
+
+    def _cookie_nonce(self):
+        '''Get the nonce kept in the cookie by the authorization request.
+
+        Returns:
+            (str): the nonce; an empty string if there is none.
+        '''
+        cookie = SimpleCookie()
+        try:
+            cookie.load(self.headers.get('Cookie', ''))
+        except Exception:
+            return ''
+        morsel = cookie.get(NONCE_COOKIE)
+        return morsel.value if morsel else ''
+
+    def end_headers(self):
+        # a nonce is used once; clear its cookie in the callback response
+        if self.command == 'POST':
+            self.send_header('Set-Cookie', _nonce_cookie('', 0))
+        super().end_headers()
 
     def do_GET(self):
-        os.environ['STATE'] = secrets.token_hex(16)
+        state = make_state()
         auth_params = {
             'response_type': 'code',
             'scope': 'notify',
             'response_mode': 'form_post',
             'redirect_uri': REDIRECT_URI,
             'client_id': os.environ['CLIENT_ID'],
-            'state': os.environ['STATE']
+            'state': state
         }
         params = '&'.join([f'{k}={v}' for k, v in auth_params.items()])
         url = f"https://notify-bot.line.me/oauth/authorize?{params}"
-        self._redirect_to(url)
+        # bind the state to the browser
+        self._redirect_to(url, cookie=_nonce_cookie(state.split('.')[0]))
 
     def do_POST(self):
         content_length = int(self.headers['Content-Length'])
@@ -55,8 +210,7 @@ class handler(BaseHTTPRequestHandler):
         params = parse_qs(post_data)
 
         state = params.get('state', [''])[0]
-        STATE = os.environ.get('STATE', '')
-        if state != STATE:
+        if not verify_state(state, nonce=self._cookie_nonce()):
             self.send_response(400)
             self.end_headers()
             self.wfile.write(b'Invalid state parameter')
@@ -71,7 +225,40 @@ class handler(BaseHTTPRequestHandler):
             'code': code
         }
         url = 'https://notify-bot.line.me/oauth/token'
-        response = requests.post(url, data=token_params)
-        token = response.json().get('access_token', '')
-        self._redirect_to(f"{HOME_URL}/api/subscribe?token={token}")
+
+        # Render the subscription page here instead of redirecting to it, and
+        # load the tables while the code is exchanged for the token.
+        pool = ThreadPoolExecutor(max_workers=3)
+        try:
+            f_tbl, f_subs_d, f_subs_w = start_loads(pool)
+
+            with timing.phase('token-exchange'), timing.call('line'):
+                response = requests.post(url, data=token_params)
+            token = response.json().get('access_token', '')
+
+            with timing.phase('token-status'):
+                status = token_status(token)
+            target = status.get('target', '')
+            if not target:
+                self._send_error(status['status'], status['message'])
+                return
+
+            tbl = f_tbl.result()
+            try:
+                name = resolve_name(tbl, target, token)
+            except Exception as e:
+                self._send_error(423, str(e))
+                return
+
+            subs_d = f_subs_d.result()
+            subs_w = f_subs_w.result()
+        finally:
+            # do not wait for loads that are no longer needed
+            pool.shutdown(wait=False)
+
+        with timing.phase('render'):
+            page = SubscriptionPage(token, name, subs_d, subs_w)
+            # show the bookmarkable URL of the page in the address bar
+            html = page.html(location=f"/api/subscribe?token={token}")
+        self._send_html(html)
 
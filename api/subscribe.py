@@ -2,7 +2,7 @@
 The module implement a Vercel Serverlesss Function to subscrip topics of news.
 """
 __author__ = "York <york.jong@gmail.com>"
-__date__ = "2023/05/04 (initial version) ~ 2023/05/10 (last revision)"
+__date__ = "2023/05/04 (initial version) ~ 2026/10/19 (last revision)"
 
 __all__ = [
     'handler',
@@ -13,6 +13,7 @@ import sys
 from urllib.parse import urlparse, parse_qs
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from json import JSONDecodeError
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
@@ -22,22 +23,18 @@ else:
     # on Vercel environment
     sys.path.append(os.path.join(os.getcwd(), 'src'))
 
-from line import token_status, is_invalid_token
+import timing
+from line import token_status
 from gdrive import TokenTable, Subscriptions
+from subscribe_page import (
+    c, page_etag, start_loads, resolve_name, SubscriptionPage)
 
 
 #------------------------------------------------------------------------------
 # handler of the Vercel serverless function
 #------------------------------------------------------------------------------
 
-# dict for comments to topics
-c = {
-    'IT': ' (AI, Software)',
-    '#AI': ', #robotics, #brain',
-}
-
-
-class handler(BaseHTTPRequestHandler):
+class handler(timing.ServerTimingMixin, BaseHTTPRequestHandler):
     '''handler of the Vercel Serverless Function.
 
     Note: The class name must be handler.
@@ -54,94 +51,89 @@ class handler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(err_msg.encode())
 
-    def _send_html(self, html):
+    def _send_html(self, html, etag=None):
         '''Send a normal (code 200) HTML page.
 
         Args:
             html (str): a HTML string to send.
+            etag (str): the entity tag of the page, if any.
         '''
         self.send_response(200)
         self.send_header('Content-type', 'text/html')
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
         self.end_headers()
         self.wfile.write(html.encode())
 
+    def _send_not_modified(self, etag):
+        '''Send a 304 Not Modified response.
+
+        Args:
+            etag (str): the entity tag of the page.
+        '''
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+    def _is_not_modified(self, etag):
+        '''Check if the client has the page of an entity tag.
+
+        Args:
+            etag (str): the entity tag of the page.
+
+        Returns:
+            (bool): True if If-None-Match of the request matches the tag.
+        '''
+        tags = self.headers.get('If-None-Match', '')
+        return etag in [t.strip() for t in tags.split(',')]
+
     def do_GET(self):
         query = urlparse(self.path).query
         params = parse_qs(query)
-
         token = params.get('token', [''])[0]
-        status = token_status(token)
-        target = status.get('target', '')
 
-        if not target:
-            self._send_error(status['status'], status['message'])
+        # the tag depends only on the token and the versions of the files, so
+        # a cached page is revalidated before any content is downloaded.
+        with timing.phase('etag'):
+            etag = page_etag(token)
+        if etag and self._is_not_modified(etag):
+            self._send_not_modified(etag)
             return
 
-        tbl = TokenTable('access_tokens.yml')
-        name = tbl.gen_unique_name(target, token)
-        if name != target:
-            # check if the old token is invalid.
-            if is_invalid_token(tbl[target]):
-                tbl[target] = token     # use new token
-                try:
-                    tbl.save()
-                except Exception as e:
-                    self._send_error(423, str(e))
-                    return
-                name = target
-
-        subs_d = Subscriptions('subscriptions_Daily.yml')
-        daily_topics = subs_d.subscribable_topics()
-        sel_d = lambda x: " selected" if x in subs_d.topics(name) else ""
-        options_daily = "\n".join(
-            f'{" "*12}<option value="{t}"{sel_d(t)}>{t}{c.get(t, "")}</option>'
-            for t in daily_topics)
-
-        subs_w = Subscriptions('subscriptions_Weekly.yml')
-        weekly_topics = subs_w.subscribable_topics()
-        sel_w = lambda x: " selected" if x in subs_w.topics(name) else ""
-        options_weekly = "\n".join(
-            f'{" "*4}<option value="{t}"{sel_w(t)}>{t} (Weekly)</option>'
-            for t in weekly_topics)
-
-        n_options = len(daily_topics) + len(weekly_topics)
+        # None of the Drive loads depends on the token status, so the status
+        # check and all loads start at once. The target (hence the shard) is
+        # unknown before the status returns, so all shards are loaded.
+        pool = ThreadPoolExecutor(max_workers=4)
+        try:
+            f_status = pool.submit(
+                timing.timed('token-status', token_status), token)
+            f_tbl, f_subs_d, f_subs_w = start_loads(pool)
+
+            status = f_status.result()
+            target = status.get('target', '')
+            if not target:
+                self._send_error(status['status'], status['message'])
+                return
 
-        html = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="utf-8">
-    <title>Subscription to news-digest (token: {token})</title>
-    <style>
-        #topics {{
-            height: auto;
-            max-height: 500px;
-            overflow-y: scroll;
-        }}
-    </style>
-</head>
-<body>
-    <h1>Subscription to news-digest</h1>
-    <form method="post" action="/api/subscribe">
-        <label for="topics">請選取分類後按下訂閱（可複選）：</label><br/><br/>
-        <select name="topics" id="topics" multiple size="{n_options}">
-{options_daily}
-{options_weekly}
-        </select>
-        <input type="hidden" name="token" value="{token}">
-        <input type="hidden" name="target" value="{name}"><br/><br/>
-        <input type="submit" value="訂閱">
-    </form>
-    <ul>
-    <li><div style="background-color: #ffffcc; color: #000000; padding: 10px;">
-    請將此頁面加入書籤，以利後續更改訂閱主題
-    </div></li>
-    <li>"IT", "#AI..." 兩個分類的新聞有大量重複，建議擇一訂閱即可</li>
-    </ul>
-</body>
-</html>
-"""
-        self._send_html(html)
+            # the old-token check runs while the subscriptions are loading
+            tbl = f_tbl.result()
+            try:
+                name = resolve_name(tbl, target, token)
+            except Exception as e:
+                self._send_error(423, str(e))
+                return
+
+            subs_d = f_subs_d.result()
+            subs_w = f_subs_w.result()
+        finally:
+            # do not wait for loads that are no longer needed
+            pool.shutdown(wait=False)
+
+        with timing.phase('render'):
+            html = SubscriptionPage(token, name, subs_d, subs_w).html()
+        self._send_html(html, etag)
 
     def do_POST(self):
         content_length = int(self.headers.get('Content-Length', 0))
@@ -156,36 +148,42 @@ class handler(BaseHTTPRequestHandler):
             self._send_error(401, 'Invalid access token')
             return
 
-        tok_tbl = TokenTable('access_tokens.yml')
-        if token not in tok_tbl.tokens():
-            name = tok_tbl.add_item(token, target)
+        with timing.phase('drive-load'):
+            tok_tbl = TokenTable('access_tokens.yml', clients=[target])
+            # the original name if the token is known; other shards are
+            # loaded only if the target does not have the token.
+            name = tok_tbl.gen_unique_name(target, token)
+        try:
+            known = tok_tbl[name] == token
+        except KeyError:
+            known = False
+        if not known:
+            tok_tbl[name] = token
             try:
                 tok_tbl.save()
-            except:
+            except Exception as e:
                 self._send_error(423, str(e))
                 return
-        else:
-            # use original name
-            name = tok_tbl.gen_unique_name(target, token)
 
-        subs_w = Subscriptions('subscriptions_Weekly.yml')
+        with timing.phase('drive-load'):
+            subs_w = Subscriptions('subscriptions_Weekly.yml', clients=[name])
+            subs_d = Subscriptions('subscriptions_Daily.yml', clients=[name])
         weekly = subs_w.subscribable_topics()
         topics_daily = [t for t in topics if t not in weekly]
         topics_weekly = [t for t in topics if t in weekly]
 
-        subs_d = Subscriptions('subscriptions_Daily.yml')
         if sorted(topics_daily) != sorted(subs_d.topics(name)):
             subs_d.update_topics(name, topics_daily)
             try:
                 subs_d.save()
-            except:
+            except Exception as e:
                 self._send_error(423, str(e))
                 return
         if sorted(topics_weekly) != sorted(subs_w.topics(name)):
             subs_w.update_topics(name, topics_weekly)
             try:
                 subs_w.save()
-            except:
+            except Exception as e:
                 self._send_error(423, str(e))
                 return
 
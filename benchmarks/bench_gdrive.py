@@ -0,0 +1,262 @@
+"""
+Micro-benchmark of TokenTable and Subscriptions at scale.
+
+Synthetic tables (e.g., 1k/10k/100k clients over 50 topics) are stored in the
+in-memory stand-in of gdrive.Drive used by the tests of gdrive, which keeps
+parsed data, so load and save time a deep copy of the data and the table code
+without the network and the YAML (de)serialization. A load of the table of a
+single client (the shard of the client if sharded) is timed besides a full
+load. Each operation reports the best and the median time of the runs and the
+peak memory (tracemalloc) of an extra run. The google-api and yaml packages of
+requirements.txt must be installed.
+
+Usage:
+    python benchmarks/bench_gdrive.py [--sizes 1000 10000 100000]
+        [--topics 50] [--shards 0] [--repeat 5] [--output results.json]
+        [--baseline old.json]
+"""
+__author__ = "York <york.jong@gmail.com>"
+__date__ = "2026/10/19 (initial version) ~ 2026/10/19 (last revision)"
+
+import os
+import sys
+import copy
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import tracemalloc
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import gdrive
+from gdrive import TokenTable, Subscriptions
+
+
+#------------------------------------------------------------------------------
+# Synthetic Tables
+#------------------------------------------------------------------------------
+
+def synthesize(drive, n_clients, n_topics, n_shards=0, seed=0):
+    '''Create a synthetic token table and subscriptions in an in-memory Drive.
+
+    Half of the topics are headings and half are hashtags; each client
+    subscribes to 1 to 5 topics.
+
+    Args:
+        drive (gdrive._MemoryDrive): the in-memory Drive in use.
+        n_clients (int): the number of clients.
+        n_topics (int): the number of topics.
+        n_shards (int): the number of shards (0 for the unsharded layout).
+        seed (int): the random seed.
+
+    Returns:
+        ({str: str}): the token table (map client to token).
+    '''
+    rng = random.Random(seed)
+    tokens = {f'client{i:06d}': f'{rng.getrandbits(172):043x}'
+              for i in range(n_clients)}
+    topics = [f'Topic{i}' if i % 2 else f'#tag{i}' for i in range(n_topics)]
+    rows = {t: [] for t in topics}
+    for client in tokens:
+        for t in rng.sample(topics, rng.randint(1, 5)):
+            rows[t].append(client)
+    subs = [[[t], clients] for t, clients in rows.items()]
+
+    drive.files.clear()
+    drive.manifests.clear()
+    for data, fn, cls in ((tokens, 'access_tokens.yml', TokenTable),
+                          (subs, 'subscriptions_Daily.yml', Subscriptions)):
+        drive.create_YAML(data, fn)
+        if n_shards:
+            cls.reshard(fn, n_shards)
+    return tokens
+
+
+#------------------------------------------------------------------------------
+# Measurement
+#------------------------------------------------------------------------------
+
+def measure(func, setup=None, repeat=5):
+    '''Measure the time and the peak memory of a function.
+
+    Args:
+        func (callable): the function; it takes the result of setup if
+            setup is specified.
+        setup (callable): prepare the argument of each run (not measured).
+        repeat (int): the number of timed runs.
+
+    Returns:
+        (dict): the best and the median time (s), and the peak memory (KiB)
+            allocated by an extra run.
+    '''
+    def run():
+        if setup is None:
+            t0 = time.perf_counter()
+            func()
+        else:
+            arg = setup()
+            t0 = time.perf_counter()
+            func(arg)
+        return time.perf_counter() - t0
+
+    times = [run() for _ in range(repeat)]
+    arg = setup() if setup else None
+    tracemalloc.start()
+    func(arg) if setup else func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'best_s': min(times), 'median_s': statistics.median(times),
+            'peak_kib': peak / 1024}
+
+
+def bench(drive, n_clients, n_topics, n_shards, repeat):
+    '''Benchmark the operations on tables of a size.
+
+    Args:
+        drive (gdrive._MemoryDrive): the in-memory Drive in use.
+        n_clients (int): the number of clients.
+        n_topics (int): the number of topics.
+        n_shards (int): the number of shards (0 for the unsharded layout).
+        repeat (int): the number of timed runs.
+
+    Returns:
+        ([dict]): a result (see measure) of each operation.
+    '''
+    tokens = synthesize(drive, n_clients, n_topics, n_shards)
+    clients = list(tokens)
+    rng = random.Random(1)
+    some = rng.sample(clients, min(100, len(clients)))
+    client = some[0]
+    token = tokens[client]
+    tbl = TokenTable('access_tokens.yml')
+    subs = Subscriptions('subscriptions_Daily.yml')
+    topics = subs.subscribable_topics()
+
+    def fresh(obj):
+        return lambda: copy.deepcopy(obj)
+
+    def changed_tbl():
+        t = TokenTable('access_tokens.yml')
+        t[client] = f'{rng.getrandbits(172):043x}'
+        return t
+
+    def changed_subs():
+        s = Subscriptions('subscriptions_Daily.yml')
+        s.update_topics(client, rng.sample(topics, 3))
+        return s
+
+    cases = [
+        ('TokenTable', 'load',
+         lambda: TokenTable('access_tokens.yml'), None),
+        ('TokenTable', 'load (clients=[client])',
+         lambda: TokenTable('access_tokens.yml', [client]), None),
+        ('TokenTable', 'save (1 client changed)',
+         lambda t: t.save(), changed_tbl),
+        ('TokenTable', 'gen_unique_name (new)',
+         lambda: tbl.gen_unique_name('newcomer', 'NEW_TOKEN'), None),
+        ('TokenTable', 'gen_unique_name (repeated name)',
+         lambda: tbl.gen_unique_name(client, 'NEW_TOKEN'), None),
+        ('TokenTable', 'gen_unique_name (renamed target)',
+         lambda: tbl.gen_unique_name('renamed', token), None),
+        ('TokenTable', 'client',
+         lambda: tbl.client(token), None),
+        ('TokenTable', 'clients_from_tokens (100)',
+         lambda: tbl.clients_from_tokens([tokens[c] for c in some]), None),
+        ('TokenTable', 'remove_clients (100)',
+         lambda t: t.remove_clients(some), fresh(tbl)),
+        ('TokenTable', 'rename',
+         lambda t: t.rename(client, 'renamed'), fresh(tbl)),
+        ('Subscriptions', 'load',
+         lambda: Subscriptions('subscriptions_Daily.yml'), None),
+        ('Subscriptions', 'load (clients=[client])',
+         lambda: Subscriptions('subscriptions_Daily.yml', [client]), None),
+        ('Subscriptions', 'save (1 client changed)',
+         lambda s: s.save(), changed_subs),
+        ('Subscriptions', 'topics',
+         lambda: subs.topics(client), None),
+        ('Subscriptions', 'update_topics',
+         lambda s: s.update_topics(client, topics[:3]), fresh(subs)),
+        ('Subscriptions', 'remove_clients (100)',
+         lambda s: s.remove_clients(some), fresh(subs)),
+        ('Subscriptions', 'rename',
+         lambda s: s.rename(client, 'renamed'), fresh(subs)),
+    ]
+    results = []
+    for table, op, func, setup in cases:
+        result = {'table': table, 'op': op, 'clients': n_clients,
+                  'topics': n_topics, 'shards': n_shards}
+        result.update(measure(func, setup, repeat))
+        results.append(result)
+    return results
+
+
+#------------------------------------------------------------------------------
+# Report
+#------------------------------------------------------------------------------
+
+def _key(result):
+    return (result['table'], result['op'], result['clients'],
+            result['topics'], result['shards'])
+
+
+def print_results(results, baseline=None):
+    '''Print results as a table.
+
+    Args:
+        results ([dict]): the results.
+        baseline ([dict]): results of a previous run to compare with; the
+            ratio of best times (baseline / now) is printed if specified.
+    '''
+    base = {_key(r): r for r in baseline or []}
+    print(f'{"table":<14}{"operation":<34}{"clients":>8}{"best":>11}'
+          f'{"median":>11}{"peak":>11}' + ('  speedup' if base else ''))
+    for r in results:
+        row = (f'{r["table"]:<14}{r["op"]:<34}{r["clients"]:>8}'
+               f'{r["best_s"]*1000:>9.3f}ms{r["median_s"]*1000:>9.3f}ms'
+               f'{r["peak_kib"]:>8.0f}KiB')
+        old = base.get(_key(r))
+        if old and r['best_s']:
+            row += f'  {old["best_s"] / r["best_s"]:>6.2f}x'
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--topics', type=int, default=50)
+    parser.add_argument('--shards', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write the results to a JSON file')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    args = parser.parse_args()
+
+    results = []
+    with gdrive._memory_drive({}) as drive:
+        for n in args.sizes:
+            results += bench(drive, n, args.topics, args.shards, args.repeat)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    if args.output:
+        report = {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark of cold and warm 7-day merges of journals.
+
+It compares clip.merge_recent_journals with the JournalCache of an empty
+(cold) and a filled (warm) cache directory, and checks that the cached index
+equals the index of clip.merge_recent_journals. The clip, op and hashtag
+modules of news-digest must be importable (e.g., placed in src/).
+
+Usage:
+    python benchmarks/bench_journal_cache.py [--days 7] [--repeat 3]
+"""
+__author__ = "York <york.jong@gmail.com>"
+__date__ = "2026/10/19 (initial version) ~ 2026/10/19 (last revision)"
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import clip
+from news_index import NewsIndex
+from journal_cache import JournalCache
+
+
+def timeit(func, repeat):
+    '''Time a function.
+
+    Args:
+        func (callable): the function to time.
+        repeat (int): the number of runs.
+
+    Returns:
+        (float): the best elapsed time (s) of the runs.
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    expected = NewsIndex(clip.merge_recent_journals(days=args.days))
+    baseline = timeit(
+        lambda: NewsIndex(clip.merge_recent_journals(days=args.days)),
+        args.repeat)
+
+    def cold():
+        with tempfile.TemporaryDirectory() as path:
+            JournalCache(path).recent(args.days)
+
+    with tempfile.TemporaryDirectory() as path:
+        cold_index = JournalCache(path).recent(args.days)   # fill the cache
+        assert cold_index.sections == expected.sections, \
+            'the cold index differs from clip.merge_recent_journals'
+        cache = JournalCache(path)
+        assert cache.recent(args.days).sections == expected.sections, \
+            'the warm index differs from clip.merge_recent_journals'
+        cache.fetched = cache.parsed = 0
+        warm = timeit(lambda: cache.recent(args.days), args.repeat)
+        fetched = cache.fetched / args.repeat
+        parsed = cache.parsed / args.repeat
+    cold_ = timeit(cold, args.repeat)
+
+    print(f'{args.days}-day merge (best of {args.repeat}):')
+    print(f'  clip.merge_recent_journals + index: {baseline:.3f}s')
+    print(f'  JournalCache (cold):                {cold_:.3f}s')
+    print(f'  JournalCache (warm):                {warm:.3f}s '
+          f'({fetched:.0f} fetched, {parsed:.0f} parsed per run)')
+
+
+if __name__ == '__main__':
+    main()
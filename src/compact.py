@@ -0,0 +1,228 @@
+"""
+The module implement the compaction of news lines before a message is split
+into Line Notify requests.
+
+News lines are mostly long URLs, so shorter URLs and fewer duplicated links
+mean fewer chunks (HTTP requests) per recipient. The compaction:
+
+- strips tracking query parameters (e.g., utm_source, fbclid) from URLs,
+- removes news lines whose links have been sent to the same recipient in
+  the same payload (e.g., a news line under both "IT" and "#AI"), and
+- trims redundant whitespace of the message.
+
+Usage:
+    python compact.py       # self test
+    python compact.py 7     # report chunks saved on journals of 7 days
+                            # (needs clip of news-digest)
+"""
+__author__ = "York <york.jong@gmail.com>"
+__date__ = "2026/10/19 (initial version) ~ 2026/10/19 (last revision)"
+
+__all__ = [
+    'canonical_url',
+    'canonical_line',
+    'is_news',
+    'drop_lines',
+    'dedupe_links',
+    'trim',
+]
+
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+
+# query parameters for tracking (compared in lower case)
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'gclsrc', 'msclkid', 'yclid', 'igshid',
+    'mc_cid', 'mc_eid', '_hsenc', '_hsmi', 'mkt_tok', 'ref_src', 'ref_url',
+    'cmpid', 'ncid', 'ocid', 'sr_share', 'spm',
+}
+
+_url_pattern = re.compile(r'https?://[^\s<>()\[\]]+')
+
+
+#------------------------------------------------------------------------------
+# URLs
+#------------------------------------------------------------------------------
+
+def _is_tracking(key):
+    key = key.lower()
+    return key.startswith('utm_') or key in TRACKING_PARAMS
+
+
+def canonical_url(url):
+    '''Strip tracking query parameters of a URL.
+
+    Other parameters are kept as they are (not re-encoded).
+
+    Args:
+        url (str): the URL.
+
+    Returns:
+        (str): the canonical URL.
+
+    Examples:
+        >>> canonical_url('https://x.com/a?id=3&utm_source=fb&fbclid=Iw')
+        'https://x.com/a?id=3'
+    '''
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    pairs = parts.query.split('&')
+    kept = [p for p in pairs if p and not _is_tracking(p.split('=', 1)[0])]
+    if len(kept) == len(pairs):
+        return url
+    return urlunsplit(parts._replace(query='&'.join(kept)))
+
+
+def canonical_line(line):
+    '''Canonicalize URLs of a line.
+
+    Args:
+        line (str): the line.
+
+    Returns:
+        (str): the line with canonical URLs.
+    '''
+    return _url_pattern.sub(lambda m: canonical_url(m.group()), line)
+
+
+#------------------------------------------------------------------------------
+# Lines
+#------------------------------------------------------------------------------
+
+def is_news(line):
+    '''Check if a line is a news line (a line with a link).
+
+    Args:
+        line (str): the line.
+
+    Returns:
+        (bool): True if the line has a link.
+    '''
+    return '://' in line
+
+
+def drop_lines(lines, drop):
+    '''Drop news lines, and other lines (e.g., headings) left without news
+    lines following them.
+
+    Args:
+        lines ([str]): the lines.
+        drop (callable): return True for a news line to drop.
+
+    Returns:
+        ([str]): the kept lines.
+    '''
+    kept = []
+    pending = []        # lines (e.g., headings) before the next news line
+    after_news = False  # True if the previous line is a news line
+    for line in lines:
+        if not is_news(line):
+            if after_news:
+                pending = []
+            pending.append(line)
+            after_news = False
+            continue
+        after_news = True
+        if drop(line):
+            continue
+        kept += pending + [line]
+        pending = []
+    return kept
+
+
+def dedupe_links(lines, seen):
+    '''Drop news lines whose links have all been seen (a news line without
+    an http(s) link, e.g., "ftp://...", is kept).
+
+    Args:
+        lines ([str]): the lines (with canonical URLs).
+        seen (set): links seen in the payload of the recipient so far; links
+            of kept lines are added to it.
+
+    Returns:
+        ([str]): the kept lines.
+    '''
+    def drop(line):
+        links = _url_pattern.findall(line)
+        if links and all(link in seen for link in links):
+            return True
+        seen.update(links)
+        return False
+    return drop_lines(lines, drop)
+
+
+def trim(message):
+    '''Trim redundant whitespace of a message.
+
+    Args:
+        message (str): the message.
+
+    Returns:
+        (str): the message without trailing spaces, repeated spaces, or runs
+            of blank lines.
+    '''
+    message = re.sub(r'[ \t]+\n', '\n', message)
+    message = re.sub(r'(?<=\S)[ \t]{2,}', ' ', message)
+    return re.sub(r'\n{3,}', '\n\n', message)
+
+
+#------------------------------------------------------------------------------
+# Test
+#------------------------------------------------------------------------------
+
+def report(days=1, max_chars=1000):
+    '''Report chunks saved by the compaction on recent journals.
+
+    Every category is taken as a topic sent to a single recipient.
+
+    Args:
+        days (int): the number of recent days.
+        max_chars (int): the maximum number of characters per chunk.
+    '''
+    from line import split_string
+    from dispatch import render
+    from journal_cache import JournalCache
+
+    index = JournalCache().recent(days)
+    topics = [[c] for c in index.categories]
+    topics += [['#AI'], ['#Robot']]
+    before = after = 0
+    seen = set()
+    for t in topics:
+        lines = index.lines(t)
+        if not lines:
+            continue
+        before += len(split_string(render(lines), max_chars))
+        lines = dedupe_links([canonical_line(x) for x in lines], seen)
+        if lines:
+            after += len(split_string(trim(render(lines)), max_chars))
+    saved = before - after
+    print(f'{days} day(s), {len(topics)} topics: {before} -> {after} chunks '
+          f'({saved} saved, {saved / max(before, 1):.1%})')
+
+
+def test():
+    url = 'https://x.com/a?id=3&utm_source=fb&fbclid=Iw#top'
+    assert canonical_url(url) == 'https://x.com/a?id=3#top'
+    assert canonical_url('https://x.com/a?utm_medium=x') == 'https://x.com/a'
+    assert canonical_url('https://x.com/a?q=%20') == 'https://x.com/a?q=%20'
+
+    lines = ['## IT', '- [a](https://a.com)', '- [b](https://b.com)',
+             '## AI', '- [a](https://a.com?utm_source=x)']
+    seen = set()
+    lines = dedupe_links([canonical_line(x) for x in lines], seen)
+    assert lines == ['## IT', '- [a](https://a.com)', '- [b](https://b.com)']
+    lines = ['## IT', '- [c](ftp://c.com)']
+    assert dedupe_links(lines, seen) == lines
+    assert trim('a  b \n\n\n\nc') == 'a b\n\nc'
+    print('OK')
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1:
+        report(int(sys.argv[1]))
+    else:
+        test()
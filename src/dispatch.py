@@ -0,0 +1,880 @@
+"""
+The module implement the headless dispatch of news digests via Line Notify.
+
+It replaces "Step 3. Line Notify" of notebooks/news_notify.ipynb so that a
+dispatch can be scheduled, profiled, or run on a worker. The clip and hashtag
+modules come from the news-digest project.
+
+Usage:
+    python -m dispatch --period Today --frequency Daily
+    python -m dispatch --period "Recent 7 Days" --frequency Weekly --dry-run
+    python -m dispatch --period Today --frequency Daily --processes 4
+    python -m dispatch --period Today --frequency Daily --window 1800 \
+        --priority
+    python -m dispatch --period Today --frequency Daily --dry-run \
+        --metrics metrics.prom --profile dispatch.folded
+"""
+__author__ = "York <york.jong@gmail.com>"
+__date__ = "2026/10/19 (initial version) ~ 2026/10/19 (last revision)"
+
+__all__ = [
+    'PERIODS',
+    'FREQUENCIES',
+    'load_content',
+    'load_index',
+    'build_messages',
+    'item_id',
+    'filter_delivered',
+    'dispatch',
+    'dispatch_spread',
+    'dispatch_processes',
+    'main',
+]
+
+import sys
+import time
+import argparse
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import clip
+import line
+import compact
+import metrics
+from gdrive import TokenTable, Subscriptions, Ledger, shard_of
+from news_index import NewsIndex
+from journal_cache import JournalCache
+from scheduler import (Delivery, SpreadScheduler, TargetTypes,
+                       fetch_statuses, priority_of)
+
+
+#------------------------------------------------------------------------------
+# Periods of the News
+#------------------------------------------------------------------------------
+
+def _check_today(filename):
+    '''Warn if the latest journal is not of today.
+
+    Args:
+        filename (str): the filename of the latest journal (e.g.,
+            "2023_05_12.md").
+    '''
+    today = datetime.today().strftime('%Y_%m_%d')
+    last = filename[:-3]
+    if today != last:
+        print(f'last date: {last}')
+        print(f'today: {today}')
+
+
+def news_today():
+    _check_today(clip.get_recent_journal_filenames(1)[0])
+    return clip.get_latest_journal()
+
+
+def news_yesterday():
+    fns = clip.get_recent_journal_filenames(2)
+    return clip.get_journal(fns[-2])
+
+
+def news_recent2days():
+    return clip.merge_recent_journals(days=2)
+
+
+def news_recent7days():
+    return clip.merge_recent_journals(days=7)
+
+
+# map a period to the function loading its news
+PERIODS = {
+    'Today': news_today,
+    'Yesterday': news_yesterday,
+    'Recent 2 Days': news_recent2days,
+    'Recent 7 Days': news_recent7days,
+}
+
+# map a period to the publication frequencies allowed with it
+FREQUENCIES = {
+    'Today': ('Daily', 'Any'),
+    'Yesterday': ('Daily', 'Any'),
+    'Recent 2 Days': ('2 Daily', 'Any'),
+    'Recent 7 Days': ('Weekly', 'Any'),
+}
+
+
+def load_content(period):
+    '''Load the news of a period.
+
+    Args:
+        period (str): a period in PERIODS.
+
+    Returns:
+        (str): the content (markdown) of the news.
+    '''
+    return PERIODS[period]()
+
+
+def load_index(period, cache=None):
+    '''Load the index of the news of a period.
+
+    Args:
+        period (str): a period in PERIODS.
+        cache (JournalCache): the journal cache; the news is loaded with clip
+            and indexed without a cache if None.
+
+    Returns:
+        (NewsIndex): the index of the news.
+    '''
+    if cache is None:
+        return NewsIndex(load_content(period))
+    if period == 'Today':
+        fns = clip.get_recent_journal_filenames(1)
+        _check_today(fns[-1])
+        return cache.index(fns, latest=fns[-1])
+    if period == 'Yesterday':
+        fns = clip.get_recent_journal_filenames(2)
+        return cache.index(fns[-2:-1])
+    days = {'Recent 2 Days': 2, 'Recent 7 Days': 7}[period]
+    return cache.recent(days)
+
+
+#------------------------------------------------------------------------------
+# Messages
+#------------------------------------------------------------------------------
+
+def render(lines, compacted=False):
+    '''Render lines of news as a message.
+
+    Args:
+        lines ([str]): the lines (markdown).
+        compacted (bool): True to trim redundant whitespace (see compact).
+
+    Returns:
+        (str): the message.
+    '''
+    text = clip.markdown_to_readable('\n'.join(lines))
+    if compacted:
+        text = compact.trim(text)
+    return f'\n{text}'
+
+
+def build_messages(index, subscriptions, show_headings=True,
+                   compacted=False):
+    '''Build the message of each subscription row.
+
+    Args:
+        index (NewsIndex): the index of the content of the news.
+        subscriptions (Subscriptions): the subscriptions.
+        show_headings (bool): True to keep headings of categories.
+        compacted (bool): True to strip tracking parameters of URLs and trim
+            whitespace (see compact).
+
+    Returns:
+        ([([str], [str], str, [str], [str])]): a list of (topics, lines,
+            message, clients, raw lines) for rows with news, where raw lines
+            are the lines without the compaction (None if not compacted).
+    '''
+    messages = []
+    for topics, clients in subscriptions:
+        with metrics.timer('dispatch_filter_seconds'):
+            lines = index.lines(topics, show_headings)
+        if not lines:
+            continue
+        raw = None
+        if compacted:
+            raw, lines = lines, [compact.canonical_line(x) for x in lines]
+        with metrics.timer('dispatch_render_seconds'):
+            msg = render(lines, compacted)
+        messages.append((topics, lines, msg, clients, raw))
+    return messages
+
+
+def item_id(line):
+    '''Get the ledger ID of a news line.
+
+    The ID is of the canonical line (see compact.canonical_line), so a line
+    has the same ID with and without the compaction, and regardless of the
+    tracking parameters of its URLs.
+
+    Args:
+        line (str): the news line.
+
+    Returns:
+        (str): the ID (see Ledger.item_id).
+    '''
+    return Ledger.item_id(compact.canonical_line(line))
+
+
+def filter_delivered(lines, delivered, ids=None):
+    '''Remove news lines which have been delivered.
+
+    A news line is a line with a link; other lines (e.g., headings) are kept
+    only if news lines follow them.
+
+    Args:
+        lines ([str]): the lines of a message.
+        delivered (set): IDs (see item_id) of delivered lines.
+        ids ({str: str}): map a news line to its ID, computed if None.
+
+    Returns:
+        ([str], [str]): the kept lines and the IDs of kept news lines.
+    '''
+    if ids is None:
+        ids = {x: item_id(x) for x in lines if compact.is_news(x)}
+    kept = compact.drop_lines(lines, lambda x: ids[x] in delivered)
+    return kept, [ids[x] for x in kept if compact.is_news(x)]
+
+
+#------------------------------------------------------------------------------
+# Dispatch
+#------------------------------------------------------------------------------
+
+class Report:
+    '''Statistics of a dispatch.
+    '''
+    def __init__(self):
+        self.rows = 0           # subscription rows
+        self.messages = 0       # (message, recipient) pairs
+        self.recipients = 0
+        self.requests = 0       # HTTP requests (chunks) to Line Notify
+        self.bytes = 0          # bytes of the chunks
+        self.latencies = []     # latencies (s) of requests
+        self.failures = {}      # map status (or error) to count
+        self.skipped = 0        # messages skipped as delivered before
+        self.filtered = 0       # news lines filtered as delivered before
+        self.uncompacted = 0    # requests without compaction (0 if unused)
+        self.elapsed = {}       # map stage to elapsed time (s)
+
+    def fail(self, reason):
+        self.failures[reason] = self.failures.get(reason, 0) + 1
+
+    def merge(self, other):
+        '''Add the counts of another report (e.g., of a shard of recipients),
+        except rows and elapsed times.
+
+        Args:
+            other (Report): the other report.
+        '''
+        self.messages += other.messages
+        self.recipients += other.recipients
+        self.requests += other.requests
+        self.bytes += other.bytes
+        self.latencies += other.latencies
+        for reason, n in other.failures.items():
+            self.failures[reason] = self.failures.get(reason, 0) + n
+        self.skipped += other.skipped
+        self.filtered += other.filtered
+        self.uncompacted += other.uncompacted
+
+    def percentile(self, p):
+        '''Get a percentile of the request latencies.
+
+        Args:
+            p (float): the percentile in [0, 100].
+
+        Returns:
+            (float): the latency in seconds (0 if no request).
+        '''
+        if not self.latencies:
+            return 0
+        xs = sorted(self.latencies)
+        return xs[min(len(xs) - 1, int(len(xs) * p / 100))]
+
+    def summary(self):
+        '''Format the report.
+
+        Returns:
+            (str): the summary of the report.
+        '''
+        send = self.elapsed.get('send', 0)
+        rate = self.requests / send if send else 0
+        stages = ', '.join(f'{k} {v:.2f}s' for k, v in self.elapsed.items())
+        failed = sum(self.failures.values())
+        lines = [
+            f'rows: {self.rows}, recipients: {self.recipients}, '
+            f'messages: {self.messages}',
+            f'requests: {self.requests} ({self.bytes} bytes), '
+            f'failed: {failed} {self.failures if failed else ""}'.rstrip(),
+            f'elapsed: {stages}',
+            f'throughput: {rate:.1f} requests/s',
+            f'latency: p50 {self.percentile(50)*1000:.1f}ms, '
+            f'p95 {self.percentile(95)*1000:.1f}ms, '
+            f'max {max(self.latencies, default=0)*1000:.1f}ms',
+        ]
+        if self.skipped or self.filtered:
+            lines.insert(2, f'delivered before: {self.filtered} lines '
+                            f'filtered, {self.skipped} messages skipped')
+        if self.uncompacted:
+            saved = self.uncompacted - self.requests
+            lines.insert(2, f'compaction: {saved} requests saved '
+                            f'({saved / self.uncompacted:.1%})')
+        return '\n'.join(lines)
+
+
+def _deliver(msgs, token, dry_run):
+    '''Deliver messages to a recipient in order.
+
+    Args:
+        msgs ([str]): the messages.
+        token (str): the access token of the recipient.
+        dry_run (bool): True to skip the network send.
+
+    Returns:
+        ([(int, int, float)]): (status, bytes, latency) of each request; the
+            status is None in a dry run.
+    '''
+    results = []
+    for msg in msgs:
+        with metrics.timer('dispatch_split_seconds'):
+            chunks = line.split_string(msg)
+        for m in chunks:
+            chunk = f'\n{m}'
+            t0 = time.perf_counter()
+            status = None if dry_run else line.notify(chunk, token)
+            results.append((status, len(chunk.encode()),
+                            time.perf_counter() - t0))
+    return results
+
+
+def _n_chunks(lines):
+    '''Count the requests of a message without the compaction.
+
+    Args:
+        lines ([str]): the lines (not compacted).
+
+    Returns:
+        (int): the number of chunks of the message.
+    '''
+    return len(line.split_string(render(lines)))
+
+
+def _group(messages, report, ledger=None, compacted=False):
+    '''Group messages by recipients (keeping the order of rows).
+
+    Lines delivered before are filtered out first, so the requests without
+    the compaction are counted only for messages which are still sent, and
+    the ledger savings are not taken as compaction savings.
+
+    Args:
+        messages ([([str], [str], str, [str], [str])]): (topics, lines,
+            message, clients, raw lines) built by build_messages.
+        report (Report): the report to update.
+        ledger (Ledger): see dispatch.
+        compacted (bool): see dispatch.
+
+    Returns:
+        ({str: [str]}, {str: [str]}, {str: int}): map a client to its
+            messages, map a client to IDs of the news lines in them (if
+            ledger is used), and map a client to the requests of its
+            messages without the compaction (if compacted); see _account.
+    '''
+    report.rows = len(messages)
+    inbox = {}
+    uncompacted = {}
+    delivered = {}  # map client to IDs of lines delivered before (or now)
+    ids_now = {}    # map client to IDs of lines to deliver now
+    links = {}      # map client to links sent in this dispatch
+    for _, lines, msg, clients, raw in messages:
+        n_news = sum(map(compact.is_news, lines))
+        chunks = None   # chunks of the row without the compaction
+        row_ids = None  # map a news line of the row to its ID
+        for client in clients:
+            lines_c, msg_c, raw_c = lines, msg, raw
+            if ledger is not None:
+                if client not in delivered:
+                    delivered[client] = ledger.delivered(client)
+                seen = delivered[client]
+                if row_ids is None:
+                    row_ids = {x: item_id(x) for x in lines
+                               if compact.is_news(x)}
+                kept, ids = filter_delivered(lines, seen, row_ids)
+                report.filtered += n_news - len(ids)
+                if not ids:
+                    report.skipped += 1
+                    continue
+                if len(kept) != len(lines):
+                    lines_c, msg_c = kept, render(kept, compacted)
+                    if compacted:
+                        # the raw lines of the kept (canonical) lines
+                        canonical = dict(zip(raw, lines))
+                        raw_c = compact.drop_lines(
+                            raw,
+                            lambda x: row_ids[canonical[x]] in seen)
+            if compacted:
+                if raw_c is raw:
+                    if chunks is None:
+                        chunks = _n_chunks(raw)
+                    n = chunks
+                else:
+                    n = _n_chunks(raw_c)
+                uncompacted[client] = uncompacted.get(client, 0) + n
+                kept = compact.dedupe_links(
+                    lines_c, links.setdefault(client, set()))
+                if not kept:
+                    continue
+                if len(kept) != len(lines_c):
+                    lines_c, msg_c = kept, render(kept, compacted)
+                    if ledger is not None:
+                        ids = [row_ids[x] for x in kept
+                               if compact.is_news(x)]
+            if ledger is not None:
+                if not compacted:
+                    # repeated lines of this dispatch (deduped if compacted)
+                    delivered[client].update(ids)
+                ids_now.setdefault(client, []).extend(ids)
+            inbox.setdefault(client, []).append(msg_c)
+    report.recipients = len(inbox)
+    report.messages = sum(len(msgs) for msgs in inbox.values())
+    return inbox, ids_now, uncompacted
+
+
+def _account(report, results, ledger=None, client=None, ids=(),
+             dry_run=False, uncompacted=0):
+    '''Add the results of a delivery to a report.
+
+    The requests without the compaction are counted here (instead of in
+    _group), so recipients which are not sent (e.g., without a token) do not
+    inflate the compaction savings.
+
+    Args:
+        report (Report): the report to update.
+        results ([(int, int, float)]): the results returned by _deliver.
+        ledger (Ledger): if specified, the IDs are recorded for the client
+            when all requests succeed (except in a dry run).
+        client (str): the client.
+        ids ([str]): IDs of the news lines delivered.
+        dry_run (bool): True if it is a dry run.
+        uncompacted (int): the requests of the delivery without the
+            compaction (0 if not compacted).
+    '''
+    metrics.observe('dispatch_chunks_per_recipient', len(results))
+    report.uncompacted += uncompacted
+    ok = True
+    for status, n_bytes, latency in results:
+        report.requests += 1
+        report.bytes += n_bytes
+        report.latencies.append(latency)
+        if status is not None and status != 200:
+            report.fail(status)
+            ok = False
+    if ledger is not None and ok and not dry_run:
+        ledger.record(client, ids)
+
+
+def dispatch(messages, tok_tbl, dry_run=False, workers=8, report=None,
+             ledger=None, compacted=False):
+    '''Send messages to their recipients.
+
+    Recipients are served in parallel; the messages of a recipient are sent
+    in order by a single worker.
+
+    Args:
+        messages ([([str], [str], str, [str], [str])]): (topics, lines,
+            message, clients, raw lines) built by build_messages.
+        tok_tbl (TokenTable): the token table.
+        dry_run (bool): True to do everything except the network send.
+        workers (int): the number of worker threads.
+        report (Report): the report to update; a new one if None.
+        ledger (Ledger): if specified, news lines delivered to a client before
+            are removed from its messages, and the lines delivered now are
+            recorded (except in a dry run).
+        compacted (bool): True to remove news lines whose links have been
+            sent to the same recipient in this dispatch (the messages should
+            be built with compacted=True).
+
+    Returns:
+        (Report): the report.
+    '''
+    report = report or Report()
+    inbox, ids_now, uncompacted = _group(messages, report, ledger,
+                                         compacted)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for client, msgs in inbox.items():
+            try:
+                token = tok_tbl[client]
+            except KeyError:
+                report.fail('unknown client')
+                continue
+            futures[client] = pool.submit(_deliver, msgs, token, dry_run)
+        for client, future in futures.items():
+            try:
+                results = future.result()
+            except Exception as e:
+                report.fail(type(e).__name__)
+                continue
+            _account(report, results, ledger, client,
+                     ids_now.get(client, []), dry_run,
+                     uncompacted.get(client, 0))
+    report.elapsed['send'] = time.perf_counter() - t0
+    return report
+
+
+#------------------------------------------------------------------------------
+# Spread Dispatch
+#------------------------------------------------------------------------------
+
+def dispatch_spread(messages, tok_tbl, window, dry_run=False, workers=8,
+                    report=None, ledger=None, compacted=False,
+                    priority=False, report_every=60):
+    '''Send messages to their recipients spread over a time window.
+
+    Recipients are released at a steady pace by a SpreadScheduler so that
+    the last one is released before the end of the window; the messages of
+    a recipient are sent in order by a single worker.
+
+    Args:
+        messages ([([str], [str], str, [str], [str])]): (topics, lines,
+            message, clients, raw lines) built by build_messages.
+        tok_tbl (TokenTable): the token table.
+        window (float): the time window in seconds.
+        dry_run (bool): True to do everything except the network send.
+        workers (int): the number of worker threads.
+        report (Report): the report to update; a new one if None.
+        ledger (Ledger): see dispatch.
+        compacted (bool): see dispatch.
+        priority (bool): True to serve groups before 1-on-1 chats; the
+            target types are cached (see TargetTypes), so only the statuses
+            of tokens not cached are fetched, and those with invalid tokens
+            (401) are skipped.
+        report_every (float): the interval (in seconds) of progress reports.
+
+    Returns:
+        (Report): the report.
+    '''
+    report = report or Report()
+    inbox, ids_now, uncompacted = _group(messages, report, ledger,
+                                         compacted)
+
+    deliveries = []
+    for client, msgs in inbox.items():
+        try:
+            deliveries.append(Delivery(client, tok_tbl[client], msgs))
+        except KeyError:
+            report.fail('unknown client')
+    if priority:
+        t0 = time.perf_counter()
+        types = TargetTypes()
+        statuses = fetch_statuses(
+            [d.token for d in deliveries if types.get(d.token) is None])
+        types.update(statuses)
+        try:
+            types.save()
+        except OSError as e:
+            print(f'Failed to save the target types: {e}')
+        for d in deliveries:
+            d.priority = priority_of(
+                statuses.get(d.token) or {'targetType': types.get(d.token)})
+        invalid = [d for d in deliveries
+                   if statuses.get(d.token, {}).get('status') == 401]
+        for d in invalid:
+            report.fail('invalid token')
+            deliveries.remove(d)
+        report.elapsed['status'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    scheduler = SpreadScheduler(
+        window, workers, report_every,
+        send=lambda d: _deliver(d.msgs, d.token, dry_run))
+    outcomes, _ = scheduler.run(
+        deliveries, statuses=lambda results: [r[0] for r in results])
+    for delivery, results, error in outcomes:
+        if error is not None:
+            report.fail(type(error).__name__)
+            continue
+        _account(report, results, ledger, delivery.client,
+                 ids_now.get(delivery.client, []), dry_run,
+                 uncompacted.get(delivery.client, 0))
+    report.elapsed['send'] = time.perf_counter() - t0
+    return report
+
+
+#------------------------------------------------------------------------------
+# Multi-process Dispatch
+#------------------------------------------------------------------------------
+
+# read-only state of a worker process, set once by _init_worker
+_worker = {}
+
+
+class _LedgerShard:
+    '''The part of a ledger for a shard of clients in a worker process.
+
+    It has the delivered() and record() used by dispatch; recorded IDs are
+    returned to the parent process, which records them to the ledger.
+    '''
+    def __init__(self, delivered):
+        '''
+        Args:
+            delivered ({str: set}): map a client to IDs delivered before.
+        '''
+        self._delivered = delivered
+        self.recorded = {}  # map client to IDs recorded now
+
+    def delivered(self, client):
+        return set(self._delivered.get(client, ()))
+
+    def record(self, client, ids):
+        self.recorded.setdefault(client, []).extend(ids)
+
+
+def _init_worker(messages, options, rate_limits):
+    '''Initialize a worker process.
+
+    The messages are passed once per process (instead of once per shard),
+    and the rate-limit state of tokens is shared through the proxy. The
+    metrics inherited from the parent (by a fork) are cleared, so only those
+    of the shards are merged back into the parent.
+
+    Args:
+        messages ([([str], [str], str, [str], [str])]): the messages built by
+            build_messages.
+        options (dict): dry_run, workers, and compacted of dispatch.
+        rate_limits (DictProxy): the shared rate-limit state (see
+            line.rate_limits).
+    '''
+    _worker['messages'] = messages
+    _worker['options'] = options
+    line.rate_limits = rate_limits
+    metrics.reset()
+
+
+def _dispatch_shard(tokens, delivered):
+    '''Dispatch messages to a shard of recipients in a worker process.
+
+    Args:
+        tokens ({str: str}): map a client of the shard to its token.
+        delivered ({str: set}): map a client of the shard to IDs delivered
+            before; None if the ledger is not used.
+
+    Returns:
+        (Report, {str: [str]}, dict): the report of the shard, the IDs to
+            record for each client, and the snapshot of the metrics of the
+            shard (see metrics.snapshot).
+    '''
+    messages = []
+    for topics, lines, msg, clients, raw in _worker['messages']:
+        clients = [c for c in clients if c in tokens]
+        if clients:
+            messages.append((topics, lines, msg, clients, raw))
+    ledger = None if delivered is None else _LedgerShard(delivered)
+    opts = _worker['options']
+    report = dispatch(messages, tokens, opts['dry_run'], opts['workers'],
+                      ledger=ledger, compacted=opts['compacted'])
+    return (report, (ledger.recorded if ledger else {}),
+            metrics.snapshot(reset=True))
+
+
+def dispatch_processes(messages, tok_tbl, processes, dry_run=False,
+                       workers=8, report=None, ledger=None, compacted=False):
+    '''Send messages to their recipients with a pool of processes.
+
+    Recipients are hashed (see gdrive.shard_of) into shards, and each shard
+    is dispatched by a worker process as dispatch does, so the per-recipient
+    work (compaction, ledger filtering, rendering, and splitting) scales with
+    cores, and the messages of a recipient are still sent in order by a
+    single thread. The rate-limit state of tokens is shared by the worker
+    processes through a multiprocessing manager, so a token that has used
+    up its calls is not sent again before its limit is reset.
+
+    Args:
+        messages ([([str], [str], str, [str], [str])]): (topics, lines,
+            message, clients, raw lines) built by build_messages.
+        tok_tbl (TokenTable): the token table.
+        processes (int): the number of worker processes.
+        dry_run (bool): True to do everything except the network send.
+        workers (int): the number of worker threads per process.
+        report (Report): the report to update; a new one if None.
+        ledger (Ledger): the ledger (see dispatch); IDs delivered by the
+            worker processes are recorded to it.
+        compacted (bool): see dispatch.
+
+    Returns:
+        (Report): the report.
+    '''
+    report = report or Report()
+    report.rows = len(messages)
+
+    # shard recipients; several shards per process to balance the load
+    n_shards = processes * 4
+    shards = [({}, None if ledger is None else {}) for _ in range(n_shards)]
+    recipients = dict.fromkeys(c for m in messages for c in m[3])
+    for client in recipients:
+        tokens, delivered = shards[shard_of(client, n_shards)]
+        try:
+            tokens[client] = tok_tbl[client]
+        except KeyError:
+            report.fail('unknown client')
+            continue
+        if delivered is not None:
+            delivered[client] = ledger.delivered(client)
+    shards = [shard for shard in shards if shard[0]]
+
+    t0 = time.perf_counter()
+    options = {'dry_run': dry_run, 'workers': workers,
+               'compacted': compacted}
+    with multiprocessing.Manager() as manager:
+        rate_limits = manager.dict(line.rate_limits)
+        with ProcessPoolExecutor(
+                max_workers=processes, initializer=_init_worker,
+                initargs=(messages, options, rate_limits)) as pool:
+            futures = [pool.submit(_dispatch_shard, *shard)
+                       for shard in shards]
+            for future in futures:
+                try:
+                    shard_report, recorded, snap = future.result()
+                except Exception as e:
+                    report.fail(type(e).__name__)
+                    continue
+                report.merge(shard_report)
+                metrics.merge(snap)
+                if ledger is not None and not dry_run:
+                    for client, ids in recorded.items():
+                        ledger.record(client, ids)
+        line.rate_limits.update(rate_limits)
+    report.elapsed['send'] = time.perf_counter() - t0
+    return report
+
+
+#------------------------------------------------------------------------------
+# Command
+#------------------------------------------------------------------------------
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m dispatch',
+        description='Dispatch news digests to subscribers via Line Notify.')
+    parser.add_argument('--period', choices=list(PERIODS), required=True,
+                        help='period of the news')
+    parser.add_argument('--frequency', choices=['Daily', '2 Daily', 'Weekly',
+                                                'Any'],
+                        required=True, help='publication frequency')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='do everything except the network send')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='number of worker threads (per process) '
+                             '(default: 8)')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of worker processes; recipients are '
+                             'sharded across them if > 1 (default: 1)')
+    parser.add_argument('--no-headings', dest='show_headings',
+                        action='store_false',
+                        help='do not show headings of categories')
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help='do not use the local journal cache')
+    parser.add_argument('--ledger', action='store_true',
+                        help='skip news lines delivered before (recorded in '
+                             'delivered.yml)')
+    parser.add_argument('--compact', action='store_true',
+                        help='strip tracking parameters of URLs, duplicated '
+                             'links, and redundant whitespace')
+    parser.add_argument('--window', type=float, default=0,
+                        help='spread the deliveries over a time window in '
+                             'seconds (default: 0, all at once)')
+    parser.add_argument('--priority', action='store_true',
+                        help='with --window, serve groups before 1-on-1 '
+                             'chats (fetching the status of each token)')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='write metrics of the run to PATH (Prometheus '
+                             'text if it ends with .prom or .txt, or JSON)')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='sample the stacks of all threads while '
+                             'building and sending, print the top '
+                             'functions, and write collapsed stacks to PATH '
+                             '(worker processes are not sampled)')
+    parser.add_argument('--verbose', action='store_true',
+                        help='print the message of each subscription row')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    '''Run a dispatch from the command line.
+
+    Args:
+        argv ([str]): the arguments; sys.argv[1:] if None.
+
+    Returns:
+        (int): the exit code: 0 if all requests succeed; 1 if any fails; 2
+            if the arguments are invalid.
+    '''
+    args = _parse_args(argv)
+    if args.frequency not in FREQUENCIES[args.period]:
+        print(f'The period is "{args.period}"')
+        print(f'The frequency must be one of {FREQUENCIES[args.period]}')
+        return 2
+    if args.window and args.processes > 1:
+        print('--window cannot be used with --processes')
+        return 2
+    if args.priority and not args.window:
+        print('--priority must be used with --window')
+        return 2
+
+    report = Report()
+    t0 = time.perf_counter()
+    cache = JournalCache() if args.cache else None
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        f_index = pool.submit(load_index, args.period, cache)
+        f_subs = pool.submit(
+            Subscriptions, f'subscriptions_{args.frequency}.yml')
+        f_tbl = pool.submit(TokenTable, 'access_tokens.yml')
+        # a dry run does not create the ledger on Drive
+        f_ledger = pool.submit(Ledger, create=not args.dry_run) \
+            if args.ledger else None
+        index, subscriptions, tok_tbl = (
+            f_index.result(), f_subs.result(), f_tbl.result())
+        ledger = f_ledger.result() if f_ledger else None
+    report.elapsed['load'] = time.perf_counter() - t0
+
+    sampler = None
+    if args.profile:
+        sampler = metrics.Sampler()
+        sampler.start()
+
+    t0 = time.perf_counter()
+    messages = build_messages(
+        index, subscriptions, args.show_headings, args.compact)
+    report.elapsed['build'] = time.perf_counter() - t0
+    if args.verbose:
+        for topics, _, msg, clients, _ in messages:
+            print(f'--- {topics} -> {clients}{msg}\n')
+
+    if args.window:
+        dispatch_spread(messages, tok_tbl, args.window, args.dry_run,
+                        args.workers, report, ledger, args.compact,
+                        args.priority)
+    elif args.processes > 1:
+        dispatch_processes(messages, tok_tbl, args.processes, args.dry_run,
+                           args.workers, report, ledger, args.compact)
+    else:
+        dispatch(messages, tok_tbl, args.dry_run, args.workers, report,
+                 ledger, args.compact)
+    if sampler is not None:
+        sampler.stop()
+    if ledger is not None and not args.dry_run:
+        t0 = time.perf_counter()
+        ledger.expire()
+        try:
+            ledger.save()
+        except Exception as e:
+            print(f'Failed to save the ledger: {e}')
+            report.fail('ledger')
+        report.elapsed['ledger'] = time.perf_counter() - t0
+    report.elapsed['total'] = sum(report.elapsed.values())
+    for stage, elapsed in report.elapsed.items():
+        metrics.observe('dispatch_stage_seconds', elapsed, stage=stage)
+
+    print(f'period: {args.period}, frequency: {args.frequency}'
+          f'{" (dry run)" if args.dry_run else ""}')
+    print(report.summary())
+    if args.metrics:
+        metrics.write(args.metrics)
+    if sampler is not None:
+        sampler.write(args.profile)
+        print(sampler.summary())
+    return 1 if report.failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
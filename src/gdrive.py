@@ -2,46 +2,138 @@
 The module implement operations of files in a folder in the Google Drive.
 """
 __author__ = "York <york.jong@gmail.com>"
-__date__ = "2023/05/05 (initial version) ~ 2023/05/12 (last revision)"
+__date__ = "2023/05/05 (initial version) ~ 2026/10/19 (last revision)"
 
 __all__ = [
     'TokenTable',
     'Subscriptions',
+    'Ledger',
 ]
 
 import os
 import re
 import json
+import copy
+import time
+import zlib
+import hashlib
+import threading
 from io import BytesIO
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 import yaml
+import httplib2
+import google_auth_httplib2
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseUpload
 from googleapiclient.errors import HttpError
 
+import timing
+import metrics
+
+
+#------------------------------------------------------------------------------
+# Sharded Layout
+#------------------------------------------------------------------------------
+
+def shard_of(client, n_shards):
+    '''Get the shard index of a client.
+
+    The index is derived from a stable hash (CRC32) so that every instance
+    maps a client to the same shard.
+
+    Args:
+        client (str): the client (target) name.
+        n_shards (int): the number of shards of a table.
+
+    Returns:
+        (int): the shard index in range(n_shards).
+    '''
+    return zlib.crc32(client.encode('utf-8')) % n_shards
+
+
+def shard_filename(filename, index):
+    '''Get the filename of a shard (e.g., "access_tokens.3.yml").
+
+    Args:
+        filename (str): the filename of the (unsharded) table.
+        index (int): the shard index.
+
+    Returns:
+        (str): the filename of the shard.
+    '''
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.{index}{ext}"
+
+
+def manifest_filename(filename):
+    '''Get the filename of the manifest of a sharded table (e.g.,
+    "access_tokens.manifest.yml").
+
+    Args:
+        filename (str): the filename of the (unsharded) table.
+
+    Returns:
+        (str): the filename of the manifest.
+    '''
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.manifest{ext}"
+
+
+#------------------------------------------------------------------------------
+# Instrumentation
+#------------------------------------------------------------------------------
+
+@contextmanager
+def _drive_call(op):
+    '''Time a Google Drive API request for the current trace and the metrics.
+
+    Args:
+        op (str): the operation (e.g., "list", "version", "download").
+    '''
+    try:
+        with timing.call('drive'), \
+                metrics.timer('drive_request_seconds', op=op):
+            yield
+    finally:
+        metrics.counter('drive_requests_total', op=op)
+
+
+#------------------------------------------------------------------------------
+# Google Drive
+#------------------------------------------------------------------------------
 
 class Drive:
     """Provide operations of files in "news-digest" folder in the Google Drive.
     """
     _instance = None    # for singleton pattern
+    _lock = threading.Lock()    # guard the creation of the singleton
+    _local = threading.local()  # per-thread HTTP object
+    _creds = None       # credentials of the service account
     _service = None     # service client of Google Drive API
+    _folder_id = None   # ID of the "news-digest" folder
     _file_table = None  # map finename to file ID on Google Drive
+    _manifests = {}     # map filename of a table to its number of shards
+    _cache = {}         # map filename to (version, data) last read or saved
 
     def __new__(cls, *args, **kwargs):
         '''Support singleton pattern.
         '''
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._service = cls._client(os.environ['SERVICE_ACCOUNT_INFO'])
-            cls._file_table = cls._file_table(os.environ['FOLDER_ID'])
+        with cls._lock:
+            if cls._instance is None:
+                cls._service = cls._client(os.environ['SERVICE_ACCOUNT_INFO'])
+                cls._folder_id = os.environ['FOLDER_ID']
+                cls._file_table = cls._file_table(cls._folder_id)
+                cls._instance = super().__new__(cls)
         return cls._instance
 
     def __init__(self):
         pass
 
-    @staticmethod
-    def _client(service_account_info):
+    @classmethod
+    def _client(cls, service_account_info):
         '''Create service client of Google Drive API.
 
         Args:
@@ -54,13 +146,30 @@ class Drive:
         info = json.loads(service_account_info)
 
         # Create Credentials object
-        creds = service_account.Credentials.from_service_account_info(
+        cls._creds = service_account.Credentials.from_service_account_info(
             info,
             scopes=['https://www.googleapis.com/auth/drive']
         )
 
         # Create a Drive API client
-        return build('drive', 'v3', credentials=creds)
+        return build('drive', 'v3', credentials=cls._creds)
+
+    @classmethod
+    def _http(cls):
+        '''Get the authorized HTTP object of the calling thread.
+
+        The HTTP object (httplib2) of the service client is not thread-safe,
+        so each thread executes requests with its own one.
+
+        Returns:
+            (google_auth_httplib2.AuthorizedHttp): the HTTP object.
+        '''
+        http = getattr(cls._local, 'http', None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(
+                cls._creds, http=httplib2.Http())
+            cls._local.http = http
+        return http
 
     @classmethod
     def _file_table(cls, folder_id):
@@ -75,18 +184,119 @@ class Drive:
         '''
         query = f"trashed = false and '{folder_id}' in parents"
         fields = "nextPageToken, files(id, name)"
-        results = cls._service.files().list(q=query, fields=fields).execute()
-        items = results.get("files", [])
-
         fn2id = {}
-        for item in items:
-            fn2id[item['name']] = item['id']
+        page_token = None
+        while True:
+            with _drive_call('list'):
+                results = cls._service.files().list(
+                    q=query, fields=fields, pageToken=page_token).execute()
+            for item in results.get("files", []):
+                fn2id[item['name']] = item['id']
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
         return fn2id
 
+    @classmethod
+    def _file_id(cls, filename):
+        '''Get the file ID of a file.
+
+        A file missing in the file table (e.g., created by another instance
+        after this one listed the folder) is looked up in the folder.
+
+        Args:
+            filename (str): the filename.
+
+        Returns:
+            (str): the file ID.
+
+        Raises:
+            KeyError: if the file does not exist.
+        '''
+        if filename not in cls._file_table:
+            query = (f"trashed = false and '{cls._folder_id}' in parents "
+                     f"and name = '{filename}'")
+            with _drive_call('list'):
+                results = cls._service.files().list(
+                    q=query, fields="files(id, name)").execute(
+                        http=cls._http())
+            files = results.get('files', [])
+            if not files:
+                raise KeyError(filename)
+            cls._file_table[filename] = files[0]['id']
+        return cls._file_table[filename]
+
+    @classmethod
+    def exists(cls, filename):
+        '''Check if a file exists in the folder.
+
+        Args:
+            filename (str): the filename.
+
+        Returns:
+            (bool): True if the file exists; False otherwise.
+        '''
+        return filename in cls._file_table
+
+    @classmethod
+    def n_shards(cls, filename, refresh=False):
+        '''Get the number of shards of a table.
+
+        A table is sharded if its manifest (e.g., "access_tokens.manifest.yml")
+        exists in the folder. The manifest is read once per instance, so an
+        instance does not see a reshard (see _Table.reshard) by itself;
+        refresh looks the manifest up again.
+
+        Args:
+            filename (str): the filename of the (unsharded) table.
+            refresh (bool): True to look up the manifest of a table known as
+                unsharded again.
+
+        Returns:
+            (int): the number of shards, or 0 if the table is not sharded.
+        '''
+        n = cls._manifests.get(filename)
+        if n is None or (refresh and not n):
+            n = 0
+            manifest = manifest_filename(filename)
+            try:
+                if refresh or cls.exists(manifest):
+                    data, _ = cls.load_YAML(manifest)
+                    n = int(data['shards'])
+            except KeyError:
+                pass
+            cls._manifests[filename] = n
+        return n
+
+    @classmethod
+    def version(cls, filename):
+        '''Get the current version of a file.
+
+        Args:
+            filename (str): the filename.
+
+        Returns:
+            (str): the version string of the file, or None if versioning is
+                disabled.
+        '''
+        file_id = cls._file_id(filename)
+        try:
+            with _drive_call('version'):
+                file = cls._service.files().get(
+                    fileId=file_id, fields='version').execute(
+                        http=cls._http())
+            return file.get('version')
+        except HttpError as error:
+            print(f"An error occurred: {error}")
+            return None
+
     @classmethod
     def load_YAML(cls, filename):
         '''Load a YAML file from the folder of the Google Dirve.
 
+        The parsed content is cached with its version, so the content is
+        downloaded only if the file has been changed since the last read.
+
         Args:
             filename (str): the filename of a YAML file.
 
@@ -97,28 +307,45 @@ class Drive:
             - The version string of the file at the time it was read, or None
               if versioning is disabled.
            '''
-        file_id = cls._file_table[filename]
+        file_id = cls._file_id(filename)
 
         # Get the current version of the file
-        try:
-            file = cls._service.files().get(
-                fileId=file_id, fields='version').execute()
-            version = file.get('version')
-        except HttpError as error:
-            print(f"An error occurred: {error}")
-            version = None
+        version = cls.version(filename)
+        cached_version, cached = cls._cache.get(filename, (None, None))
+        if version is not None and version == cached_version:
+            metrics.counter('drive_cache_hits_total')
+            return copy.deepcopy(cached), version
 
         # Read the content of the file
         try:
             response = cls._service.files().get_media(fileId=file_id)
-            content = response.execute().decode('utf-8')
+            with _drive_call('download'):
+                content = response.execute(http=cls._http()).decode('utf-8')
             # Convert YAML string to Python object
             data = yaml.safe_load(content)
         except HttpError as error:
             print(f"An error occurred: {error}")
             return None, None
+        if version is not None:
+            cls._cache[filename] = (version, copy.deepcopy(data))
         return data, version
 
+    @classmethod
+    def load_YAMLs(cls, filenames):
+        '''Load YAML files from the folder of the Google Drive in parallel.
+
+        Args:
+            filenames ([str]): the filenames of YAML files.
+
+        Returns:
+            ([(Any, str)]): a list of (data, version) tuples (see load_YAML) in
+                the order of the filenames.
+        '''
+        if len(filenames) <= 1:
+            return [cls.load_YAML(fn) for fn in filenames]
+        with ThreadPoolExecutor(max_workers=len(filenames)) as pool:
+            return list(pool.map(timing.bind(cls.load_YAML), filenames))
+
     @classmethod
     def save_YAML(cls, data, filename, version=None):
         '''Save a Python object to YAML on the folder of the Google Drive.
@@ -130,7 +357,7 @@ class Drive:
                 update will use optimistic locking to ensure that the file is
                 not updated concurrently by another process.
         '''
-        file_id = cls._file_table[filename]
+        file_id = cls._file_id(filename)
 
         # Convert the Python object to YAML string
         yaml_str = yaml.dump(data, allow_unicode=True)
@@ -140,8 +367,9 @@ class Drive:
             BytesIO(yaml_str.encode()), mimetype='text/yaml')
 
         # Get the current metadata of the file
-        meta = cls._service.files().get(
-            fileId=file_id, fields='version').execute()
+        with _drive_call('check-version'):
+            meta = cls._service.files().get(
+                fileId=file_id, fields='version').execute(http=cls._http())
 
         # Check if the current version matches the expected version
         if meta.get('version') != version:
@@ -149,31 +377,324 @@ class Drive:
             raise Exception("The file has been updated by someone else.")
 
         try:
-            cls._service.files().update(
-                fileId=file_id, media_body=media,
-                fields='version').execute()
+            with _drive_call('update'):
+                file = cls._service.files().update(
+                    fileId=file_id, media_body=media,
+                    fields='version').execute(http=cls._http())
+        except HttpError as error:
+            raise Exception(f"{error}")
+        cls._cache[filename] = (file.get('version'), copy.deepcopy(data))
+
+    @classmethod
+    def create_YAML(cls, data, filename):
+        '''Create a new YAML file on the folder of the Google Drive.
+
+        Args:
+            data (Any): The Python object to be written to the file.
+            filename (str): the filename of the new YAML file.
+        '''
+        if cls.exists(filename):
+            raise Exception(f"The file {filename} already exists.")
+
+        yaml_str = yaml.dump(data, allow_unicode=True)
+        media = MediaIoBaseUpload(
+            BytesIO(yaml_str.encode()), mimetype='text/yaml')
+        meta = {'name': filename, 'parents': [cls._folder_id]}
+        try:
+            with _drive_call('create'):
+                file = cls._service.files().create(
+                    body=meta, media_body=media,
+                    fields='id').execute(http=cls._http())
         except HttpError as error:
             raise Exception(f"{error}")
+        cls._file_table[filename] = file['id']
+
+
+class _Table:
+    '''Common loading and saving of a table stored as a YAML file or as a
+    set of YAML shards.
+
+    In the sharded layout, the clients of a table are hashed (see shard_of)
+    across N shard files, and a manifest records N. A table can then load only
+    the shards of given clients, and saving only rewrites the shards which
+    have been changed, so writes for different clients rarely conflict.
+
+    Operations on a client of a partially loaded table load the shard of the
+    client first, and look-ups over the whole table (e.g., all clients, or a
+    client by its token) load the other shards first.
+
+    Subclasses implement _merge, _split, and _keys to convert between the
+    shards and the table.
+    '''
+    def __init__(self, filename, clients=None):
+        '''Load a table from a YAML file or from its shards.
+
+        Args:
+            filename (str): the filename of the table.
+            clients ([str]): clients to operate on. If specified and the table
+                is sharded, only the shards of these clients are loaded;
+                otherwise, all shards are loaded in parallel.
+        '''
+        self._filename = filename
+        self._n_shards = Drive().n_shards(filename)
+        self._shards = {}   # map shard index to (data, version) as saved
+        if not self._n_shards:
+            self._table, self._version = Drive().load_YAML(filename)
+            return
+
+        self._version = None
+        if clients is None:
+            indices = list(range(self._n_shards))
+        else:
+            indices = sorted({shard_of(c, self._n_shards) for c in clients})
+        self._table = self._merge([])
+        self._load_indices(indices)
+
+    @property
+    def version(self):
+        '''(str): the version of the loaded file, or the versions of the
+        loaded shards (e.g., "0:12,1:7") if the table is sharded.
+        '''
+        if not self._n_shards:
+            return self._version
+        return ','.join(f'{i}:{v}'
+                        for i, (_, v) in sorted(self._shards.items()))
+
+    def _load_shards(self, indices):
+        '''Load shards of the table in parallel.
+
+        Args:
+            indices ([int]): indices of the shards to load.
+        '''
+        fns = [shard_filename(self._filename, i) for i in indices]
+        for i, result in zip(indices, Drive().load_YAMLs(fns)):
+            self._shards[i] = result
+
+    def _load_indices(self, indices):
+        '''Load shards which are not loaded yet, and merge them into the
+        table (changes of the loaded table are kept).
+
+        Args:
+            indices ([int]): indices of the shards.
+        '''
+        new = sorted(set(indices) - set(self._shards))
+        if not new:
+            return
+        self._load_shards(new)
+        self._table = self._merge(
+            [copy.deepcopy(self._shards[i][0]) for i in new] + [self._table])
+
+    def _load_clients(self, clients):
+        '''Make sure the shards of clients are loaded.
+
+        Args:
+            clients ([str]): the clients.
+        '''
+        if self._n_shards and len(self._shards) < self._n_shards:
+            self._load_indices([shard_of(c, self._n_shards) for c in clients])
+
+    def _load_all(self):
+        '''Make sure all shards are loaded.
+        '''
+        if self._n_shards:
+            self._load_indices(range(self._n_shards))
+
+    def save(self):
+        '''Save the table back to the original YAML file (or shards).
+
+        An unsharded table is not saved if the table has been resharded since
+        this instance read the manifest, since the unsharded file is no longer
+        used; it must be loaded again (from the shards).
+        '''
+        if not self._n_shards:
+            if Drive().n_shards(self._filename, refresh=True):
+                raise Exception(f"{self._filename} has been sharded; "
+                                "load it again.")
+            Drive().save_YAML(self._table, self._filename, self._version)
+            self._version = str(int(self._version) + 1)
+            return
+
+        parts = self._split(self._table, self._n_shards)
+
+        # shards of new clients may not be loaded yet; merge them with their
+        # current content, but never overwrite a client of another writer.
+        used = {shard_of(c, self._n_shards) for c in self._keys(self._table)}
+        unloaded = sorted(used - set(self._shards))
+        self._load_shards(unloaded)
+        for i in unloaded:
+            conflicts = self._conflicts(self._shards[i][0], parts[i])
+            if conflicts:
+                raise Exception(f"Clients exist in {self._filename}: "
+                                f"{sorted(conflicts)}")
+            parts[i] = self._merge([copy.deepcopy(self._shards[i][0]),
+                                    parts[i]])
+
+        # Shards are saved one by one: a client moved to another shard
+        # (e.g., renamed) is saved to the shard gaining it first, so a failed
+        # save never loses it, and the shards saved before are restored.
+        changed = [i for i, (data, _) in self._shards.items()
+                   if parts[i] != data]
+        changed.sort(key=lambda i: not (set(self._keys(parts[i])) -
+                                        set(self._keys(self._shards[i][0]))))
+        before = {i: self._shards[i] for i in changed}
+        saved = []
+        try:
+            for i in changed:
+                _, version = self._shards[i]
+                Drive().save_YAML(
+                    parts[i], shard_filename(self._filename, i), version)
+                saved.append(i)
+                self._shards[i] = (copy.deepcopy(parts[i]),
+                                   str(int(version) + 1))
+        except Exception:
+            self._restore(saved, before)
+            raise
+
+    def is_current(self):
+        '''Check if the loaded file (or the loaded shards) has not been
+        changed by other writers since loaded, e.g., before saving it with
+        other tables.
+
+        Returns:
+            (bool): True if no loaded file has been changed.
+        '''
+        if not self._n_shards:
+            return Drive().version(self._filename) == self._version
+        return all(Drive().version(shard_filename(self._filename, i)) == v
+                   for i, (_, v) in self._shards.items())
+
+    def _restore(self, indices, old):
+        '''Restore saved shards after a failed save (as far as no other
+        writer has changed them since).
+
+        Args:
+            indices ([int]): indices of the shards saved.
+            old ({int: (Any, str)}): map a shard index to its (data, version)
+                before the save.
+        '''
+        for i in reversed(indices):
+            _, version = self._shards[i]
+            try:
+                Drive().save_YAML(old[i][0],
+                                  shard_filename(self._filename, i), version)
+            except Exception as e:
+                print(f"Failed to restore "
+                      f"{shard_filename(self._filename, i)}: {e}")
+                continue
+            self._shards[i] = (old[i][0], str(int(version) + 1))
 
+    @classmethod
+    def reshard(cls, filename, n_shards):
+        '''Create the sharded layout of a table from its YAML file.
+
+        The shards are created before the manifest. Running instances have
+        read the manifest before, so they keep loading the unsharded file
+        until their next save of it, which fails (see save). A write of the
+        unsharded file during the reshard is detected afterwards, but it is
+        not in the shards; stop the writers (e.g., pause the deployment)
+        while resharding.
+
+        Args:
+            filename (str): the filename of the (unsharded) table.
+            n_shards (int): the number of shards.
+        '''
+        data, version = Drive().load_YAML(filename)
+        for i, part in enumerate(cls._split(data, n_shards)):
+            Drive().create_YAML(part, shard_filename(filename, i))
+        Drive().create_YAML({'shards': n_shards}, manifest_filename(filename))
+        if Drive().version(filename) != version:
+            raise Exception(f"{filename} was changed during the reshard; "
+                            "its changes are not in the shards.")
+
+    @staticmethod
+    def _merge(parts):
+        '''Merge shards into a table.
+
+        Args:
+            parts ([Any]): data of shards (None for an empty shard).
+
+        Returns:
+            (Any): the merged table.
+        '''
+        raise NotImplementedError
+
+    @staticmethod
+    def _split(table, n_shards):
+        '''Split a table into shards.
+
+        Args:
+            table (Any): the table.
+            n_shards (int): the number of shards.
 
-class TokenTable:
+        Returns:
+            ([Any]): data of the n_shards shards.
+        '''
+        raise NotImplementedError
+
+    @staticmethod
+    def _keys(table):
+        '''Get the clients of a table.
+
+        Args:
+            table (Any): the table.
+
+        Returns:
+            ([str]): the clients.
+        '''
+        raise NotImplementedError
+
+    @staticmethod
+    def _conflicts(data, part):
+        '''Find clients of a part which would overwrite different entries of
+        a shard when merged into it.
+
+        Args:
+            data (Any): data of the shard.
+            part (Any): the part of the table to merge into the shard.
+
+        Returns:
+            (set): the conflicting clients.
+        '''
+        return set()
+
+
+class TokenTable(_Table):
     '''Operations to map a target (i.e., a client: a user or a group) to a Line
     Notify token.
     '''
-    def __init__(self, filename="access_tokens.yml"):
+    def __init__(self, filename="access_tokens.yml", clients=None):
         '''Load a token table from a YAML file.
 
         Args:
             filename (str): the filename of the token table.
+            clients ([str]): clients to operate on; only their shards are
+                loaded if the table is sharded (look-ups by tokens load the
+                other shards).
         '''
-        self._filename = filename
-        self._table, self._version = Drive().load_YAML(filename)
+        super().__init__(filename, clients)
 
-    def save(self):
-        '''Save the token table back to the original YAML file.
-        '''
-        Drive().save_YAML(self._table, self._filename, self._version)
-        self._version = str(int(self._version) + 1)
+    @staticmethod
+    def _merge(parts):
+        table = {}
+        for part in parts:
+            table.update(part or {})
+        return table
+
+    @staticmethod
+    def _split(table, n_shards):
+        parts = [{} for _ in range(n_shards)]
+        for client, token in table.items():
+            parts[shard_of(client, n_shards)][client] = token
+        return parts
+
+    @staticmethod
+    def _keys(table):
+        return list(table)
+
+    @staticmethod
+    def _conflicts(data, part):
+        data = data or {}
+        return {c for c, v in part.items() if c in data and data[c] != v}
 
     def clients(self):
         '''Get all clients (targets) in the table.
@@ -181,6 +702,7 @@ class TokenTable:
         Returns:
             ([str]): a list of all clients (targets) in the table.
         '''
+        self._load_all()
         return list(self._table.keys())
 
     def tokens(self):
@@ -189,6 +711,7 @@ class TokenTable:
         Returns:
             ([str]): a list of all tokens in the table.
         '''
+        self._load_all()
         return list(self._table.values())
 
     def token(self, client):
@@ -200,6 +723,7 @@ class TokenTable:
         Returns:
             (str) the token
         '''
+        self._load_clients([client])
         return self._table[client]
 
     def clients_from_tokens(self, tokens):
@@ -226,6 +750,7 @@ class TokenTable:
         return self.token(client)
 
     def __setitem__(self, key, value):
+        self._load_clients([key])
         self._table[key] = value
 
     def client(self, token):
@@ -252,15 +777,11 @@ class TokenTable:
         clients = self.clients()
         if client not in clients:
             return client
-        prog = re.compile(f'{re.escape(client)}_(\d+)?$')
-        repeated = [c for c in clients if prog.match(c)]
-        if not repeated:
+        prog = re.compile(rf'{re.escape(client)}_(\d+)$')
+        nums = [int(m.group(1)) for m in map(prog.match, clients) if m]
+        if not nums:
             return f"{client}_1"
-        repeated.sort()
-        display(repeated)
-        last = repeated[-1]
-        num = int(prog.findall(last)[0])
-        return f"{client}_{num+1}"
+        return f"{client}_{max(nums)+1}"
 
     def gen_unique_name(self, client, token):
         '''Generate unique name with a client and its token.
@@ -272,6 +793,12 @@ class TokenTable:
         Returns:
             (str): the generated unique client name.
         '''
+        # the client has the token (e.g., a revisit); no need to load all
+        # shards.
+        self._load_clients([client])
+        if self._table.get(client) == token:
+            return client
+
         clients = self.clients()
         tokens = self.tokens()
         name = client
@@ -303,7 +830,7 @@ class TokenTable:
             (str): the new name of client.
         """
         name = self.gen_unique_name(client, token)
-        self._table[name] = token
+        self[name] = token
         return name
 
     def remove_clients(self, clients=[]):
@@ -312,6 +839,7 @@ class TokenTable:
         Args:
             clients ([str]): a list of clients.
         '''
+        self._load_clients(clients)
         for client in clients:
             self._table.pop(client, None)
 
@@ -332,6 +860,7 @@ class TokenTable:
         Args:
             tokens ([str]): a list of tokens.
         '''
+        self._load_all()
         clients = []
         for client, token in self._table.items():
             if token in tokens:
@@ -347,30 +876,64 @@ class TokenTable:
             old (str): the old name a target/client.
             new (str): the new name of the target/client.
         '''
+        self._load_clients([old, new])
         if old in self._table and new not in self._table:
             self._table[new] = self._table[old]
             del self._table[old]
 
-class Subscriptions:
+class Subscriptions(_Table):
     '''Operations of a news-digest subscription table.
     '''
-    def __init__(self, filename="subscriptions_Daily.yml"):
+    def __init__(self, filename="subscriptions_Daily.yml", clients=None):
         '''
         Load a subscriptions from a YAML file.
 
         Args:
             filename (str): the filename of the token table.
+            clients ([str]): clients to operate on; only their shards are
+                loaded if the table is sharded. Every shard holds all topics.
         '''
-        self._filename = filename
-        self._table, self._version = Drive().load_YAML(filename)
+        super().__init__(filename, clients)
 
-    def save(self):
-        '''Save the subscriptions back to the original YAML file.
-        '''
-        Drive().save_YAML(self._table, self._filename, self._version)
-        self._version = str(int(self._version) + 1)
+    @staticmethod
+    def _merge(parts):
+        # rows are matched by their topics; every non-empty part must have
+        # the same rows
+        table = []
+        rows = {}   # map topics to (row, set of its clients)
+        for part in parts:
+            if not part:
+                continue
+            keys = [tuple(topics) for topics, _ in part]
+            if rows and set(keys) != set(rows):
+                raise Exception(f"Topic rows of shards differ: "
+                                f"{sorted(set(keys) ^ set(rows))}")
+            for key, (topics, clients) in zip(keys, part):
+                if key not in rows:
+                    rows[key] = ([topics, []], set())
+                    table.append(rows[key][0])
+                row, seen = rows[key]
+                for c in clients:
+                    if c not in seen:
+                        seen.add(c)
+                        row[1].append(c)
+        return table
+
+    @staticmethod
+    def _split(table, n_shards):
+        parts = [[[list(topics), []] for topics, _ in table]
+                 for _ in range(n_shards)]
+        for i, (_, clients) in enumerate(table):
+            for c in clients:
+                parts[shard_of(c, n_shards)][i][1].append(c)
+        return parts
+
+    @staticmethod
+    def _keys(table):
+        return list({c for _, clients in table for c in clients})
 
     def __iter__(self):
+        self._load_all()
         for elem in self._table:
             yield elem
 
@@ -385,6 +948,19 @@ class Subscriptions:
             subscribable.append(topics[0])
         return subscribable
 
+    def index(self):
+        '''Build an index of topics subscribed by each client.
+
+        Returns:
+            ({str: [str]}): map a client to the topics subscribed by it.
+        '''
+        self._load_all()
+        index = {}
+        for topics, clients in self._table:
+            for client in clients:
+                index.setdefault(client, []).append(topics[0])
+        return index
+
     def topics(self, client=None):
         '''Get topics subscribed by a client.
 
@@ -394,6 +970,7 @@ class Subscriptions:
         Returns:
             ([str]): the topics subscribed by the client.
         '''
+        self._load_clients([client])
         subscribed = []
         for topics, clients in self._table:
             if client in clients:
@@ -410,6 +987,7 @@ class Subscriptions:
             client (str): the client.
             new_topics ([str]): a list of topics.
         '''
+        self._load_clients([client])
         for topics, clients in self._table:
             if topics[0] in new_topics:
                 if client not in clients:
@@ -424,6 +1002,7 @@ class Subscriptions:
         Returns:
             (set): all clients.
         '''
+        self._load_all()
         all = set()
         for topics, clients in self._table:
             all |= set(clients)
@@ -436,6 +1015,7 @@ class Subscriptions:
             topic (str): topic (heading) to subscribe.
             client (str): target name of a client.
         '''
+        self._load_clients([client])
         for topics, clients in self._table:
             if len(topics) != 1:
                 continue
@@ -448,11 +1028,13 @@ class Subscriptions:
         Args:
             clients_rm ([str]): a list of clients to remove.
         '''
+        self._load_clients(clients_rm)
+        rm = set(clients_rm)
         for _, clients in self._table:
-            diff = set(clients) - set(clients_rm)
-            if len(clients) > len(diff):
-                # update clients
-                clients[:] = list(diff)
+            if not rm.isdisjoint(clients):
+                # keep the order, so rows (and shards) without the clients
+                # are unchanged
+                clients[:] = [c for c in clients if c not in rm]
 
     def __delitem__(self, clients):
         '''Remove clients in the subscriptions.
@@ -482,6 +1064,121 @@ class Subscriptions:
                 clients.remove(old)
                 clients.append(new)
 
+
+class Ledger(_Table):
+    '''Operations of a delivered-item ledger, which maps a client to IDs
+    (hashes) of news lines delivered to it grouped by their expiry times,
+    i.e., {client: {expiry: [ID]}}; the IDs recorded by a dispatch share an
+    expiry time, so it is stored once per dispatch instead of once per ID.
+    '''
+    def __init__(self, filename="delivered.yml", clients=None,
+                 ttl=8*24*3600, create=True):
+        '''Load a ledger from a YAML file.
+
+        Args:
+            filename (str): the filename of the ledger.
+            clients ([str]): clients to operate on; only their shards are
+                loaded if the ledger is sharded.
+            ttl (int): the lifetime (in seconds) of a recorded ID; the default
+                (8 days) covers a weekly digest.
+            create (bool): if the file does not exist, True to create an
+                empty one, and False to use an empty ledger in memory (e.g.,
+                in a dry run), which is not to be saved.
+        '''
+        self._ttl = ttl
+        if not Drive().n_shards(filename) and not Drive().exists(filename):
+            if not create:
+                self._filename = filename
+                self._n_shards = 0
+                self._shards = {}
+                self._table, self._version = {}, None
+                return
+            Drive().create_YAML({}, filename)
+        super().__init__(filename, clients)
+        if self._table is None:
+            self._table = {}
+
+    # a ledger is sharded by clients as a token table
+    _merge = staticmethod(TokenTable._merge)
+    _split = staticmethod(TokenTable._split)
+    _keys = staticmethod(TokenTable._keys)
+    _conflicts = staticmethod(TokenTable._conflicts)
+
+    @staticmethod
+    def item_id(line):
+        '''Get the ID of a news line.
+
+        Args:
+            line (str): the news line.
+
+        Returns:
+            (str): the ID (a truncated SHA-1 of the stripped line).
+        '''
+        return hashlib.sha1(line.strip().encode('utf-8')).hexdigest()[:16]
+
+    def clients(self):
+        '''Get all clients in the ledger.
+
+        Returns:
+            ([str]): a list of all clients in the ledger.
+        '''
+        self._load_all()
+        return list(self._table.keys())
+
+    def delivered(self, client, now=None):
+        '''Get IDs of lines delivered to a client and not expired.
+
+        Args:
+            client (str): the client.
+            now (float): the current time (epoch seconds); time.time() if
+                None.
+
+        Returns:
+            (set): the IDs.
+        '''
+        now = time.time() if now is None else now
+        self._load_clients([client])
+        items = self._table.get(client, {})
+        return {i for expiry, ids in items.items() if expiry > now
+                for i in ids}
+
+    def record(self, client, ids, now=None):
+        '''Record IDs of lines delivered to a client.
+
+        Args:
+            client (str): the client.
+            ids ([str]): the IDs.
+            now (float): the current time (epoch seconds); time.time() if
+                None.
+        '''
+        now = time.time() if now is None else now
+        expiry = int(now + self._ttl)
+        self._load_clients([client])
+        items = self._table.get(client, {})
+        recorded = items.get(expiry, [])
+        seen = set(recorded)
+        new = [i for i in dict.fromkeys(ids) if i not in seen]
+        if new:
+            self._table[client] = items
+            items[expiry] = recorded + new
+
+    def expire(self, now=None):
+        '''Remove expired IDs (and clients without IDs).
+
+        Args:
+            now (float): the current time (epoch seconds); time.time() if
+                None.
+        '''
+        now = time.time() if now is None else now
+        for client in list(self._table):
+            items = {e: ids for e, ids in self._table[client].items()
+                     if e > now}
+            if items:
+                self._table[client] = items
+            else:
+                del self._table[client]
+
+
 #------------------------------------------------------------------------------
 # Unit Test
 #------------------------------------------------------------------------------
@@ -538,7 +1235,185 @@ def test_Subscriptions():
     print()
 
 
+class _MemoryDrive:
+    '''In-memory stand-in of Drive for tests.
+    '''
+    def __init__(self, files):
+        self.files = files  # map filename to (data, version)
+        self.manifests = {}  # map filename to its number of shards as read
+
+    def exists(self, filename):
+        return filename in self.files
+
+    def n_shards(self, filename, refresh=False):
+        n = self.manifests.get(filename)
+        if n is None or (refresh and not n):
+            manifest = manifest_filename(filename)
+            n = int(self.files[manifest][0]['shards']) \
+                if manifest in self.files else 0
+            self.manifests[filename] = n
+        return n
+
+    def version(self, filename):
+        return self.files[filename][1]
+
+    def load_YAML(self, filename):
+        data, version = self.files[filename]
+        return copy.deepcopy(data), version
+
+    def load_YAMLs(self, filenames):
+        return [self.load_YAML(fn) for fn in filenames]
+
+    def save_YAML(self, data, filename, version=None):
+        if self.files[filename][1] != version:
+            raise Exception("The file has been updated by someone else.")
+        self.files[filename] = (copy.deepcopy(data), str(int(version) + 1))
+
+    def create_YAML(self, data, filename):
+        self.files[filename] = (copy.deepcopy(data), '1')
+
+
+@contextmanager
+def _memory_drive(files):
+    '''Use an in-memory Drive in a block of code.
+
+    Args:
+        files ({str: (Any, str)}): map filename to (data, version).
+    '''
+    global Drive
+    saved = Drive
+    drive = _MemoryDrive(files)
+    Drive = lambda: drive
+    try:
+        yield drive
+    finally:
+        Drive = saved
+
+
+def test_shards():
+    # _split and _merge round trip
+    tokens = {f'client{i}': f'TOKEN{i}' for i in range(20)}
+    assert TokenTable._merge(TokenTable._split(tokens, 4)) == tokens
+    subs = [[['IT'], ['client1', 'client2']], [['#AI'], []],
+            [['Finance'], ['client3', 'client1']]]
+    merged = Subscriptions._merge(Subscriptions._split(subs, 4))
+    assert [t for t, _ in merged] == [t for t, _ in subs]
+    assert [set(c) for _, c in merged] == [set(c) for _, c in subs]
+
+    fn = 'access_tokens.yml'
+    files = {fn: ({'Andy': 'TOK_A', 'Andy_1': 'TOK_B', 'Bob': 'TOK_BOB'},
+                  '1')}
+    with _memory_drive(files):
+        # an instance which has loaded the unsharded file does not save it
+        # after a reshard
+        tbl = TokenTable(fn)
+        TokenTable.reshard(fn, 4)
+        tbl['Zed'] = 'TOK_Z'
+        try:
+            tbl.save()
+            assert False, 'saved'
+        except Exception as e:
+            assert 'has been sharded' in str(e)
+        assert TokenTable(fn)._n_shards == 4
+        assert shard_of('Andy', 4) != shard_of('Andy_1', 4)
+
+        # a repeated name sees clients of other shards
+        tbl = TokenTable(fn, clients=['Andy'])
+        assert tbl.add_item('TOK_C', 'Andy') == 'Andy_2'
+        tbl.save()
+        # a renamed target keeps its old name
+        tbl = TokenTable(fn, clients=['Andy'])
+        assert tbl.gen_unique_name('Andy', 'TOK_A') == 'Andy'
+        assert tbl.gen_unique_name('Bobby', 'TOK_BOB') == 'Bob'
+
+        # save into a shard which is not loaded
+        tbl = TokenTable(fn, clients=['Andy'])
+        tbl['Zed'] = 'TOK_Z'
+        tbl.save()
+        assert TokenTable(fn)._table == {
+            'Andy': 'TOK_A', 'Andy_1': 'TOK_B', 'Andy_2': 'TOK_C',
+            'Bob': 'TOK_BOB', 'Zed': 'TOK_Z'}
+
+        # never overwrite a client of an unloaded shard
+        tbl = TokenTable(fn, clients=['Andy'])
+        tbl._table['Andy_1'] = 'TOK_X'
+        try:
+            tbl.save()
+            assert False, 'overwritten'
+        except Exception as e:
+            assert 'Andy_1' in str(e)
+
+        # a rename moving a client between shards is never half-saved
+        table = TokenTable(fn)._table
+        new = next(c for c in ('Bobby', 'Rob', 'Robert')
+                   if shard_of(c, 4) != shard_of('Bob', 4))
+        for changed in ('Bob', new):    # the losing or the gaining shard
+            tbl = TokenTable(fn)
+            tbl.rename('Bob', new)
+            shard = shard_filename(fn, shard_of(changed, 4))
+            data, version = files[shard]
+            files[shard] = (data, str(int(version) + 1))  # another writer
+            try:
+                tbl.save()
+                assert False, 'saved'
+            except Exception as e:
+                assert 'updated by someone else' in str(e)
+            assert TokenTable(fn)._table == table
+
+    fn = 'subscriptions_Daily.yml'
+    files = {fn: (subs, '1')}
+    with _memory_drive(files):
+        Subscriptions.reshard(fn, 4)
+        tbl = Subscriptions(fn, clients=['client9'])
+        tbl.update_topics('client1', ['#AI'])
+        tbl.save()
+        tbl = Subscriptions(fn)
+        assert tbl.topics('client1') == ['#AI']
+        assert tbl.topics('client3') == ['Finance']
+
+        # only the shard of a removed client is saved
+        versions = {f: v for f, (_, v) in files.items()}
+        tbl.remove_clients(['client2'])
+        tbl.save()
+        assert [f for f, (_, v) in files.items() if versions[f] != v] == [
+            shard_filename(fn, shard_of('client2', 4))]
+
+    # shard rows are matched by their topics
+    assert Subscriptions._merge([[[['IT'], ['a']], [['AI'], ['b']]],
+                                 [[['AI'], ['c']], [['IT'], ['d']]]]) == [
+        [['IT'], ['a', 'd']], [['AI'], ['b', 'c']]]
+    try:
+        Subscriptions._merge([[[['IT'], ['a']]], [[['AI'], ['b']]]])
+        assert False, 'merged'
+    except Exception as e:
+        assert 'Topic rows' in str(e)
+    print('OK')
+
+
+def test_Ledger():
+    fn = 'delivered.yml'
+    files = {}
+    with _memory_drive(files):
+        # a dry run does not create the file
+        ledger = Ledger(fn, create=False)
+        ledger.record('Andy', ['a'], now=0)
+        assert ledger.delivered('Andy', now=1) == {'a'} and not files
+
+        ledger = Ledger(fn, ttl=10)
+        ledger.record('Andy', ['a', 'b', 'a'], now=0)
+        ledger.record('Andy', ['b', 'c'], now=5)
+        assert ledger._table == {'Andy': {10: ['a', 'b'], 15: ['b', 'c']}}
+        assert ledger.delivered('Andy', now=12) == {'b', 'c'}
+        ledger.expire(now=12)
+        assert ledger._table == {'Andy': {15: ['b', 'c']}}
+        ledger.save()
+        assert Ledger(fn).delivered('Andy', now=12) == {'b', 'c'}
+    print('OK')
+
+
 def main():
+    test_shards()
+    test_Ledger()
     #test_Drive()
     #test_TokenTable()
     test_Subscriptions()
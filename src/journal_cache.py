@@ -0,0 +1,136 @@
+"""
+The module implement a local cache of parsed journals of news-digest.
+
+A journal is cached as its category sections (see NewsIndex) keyed by its
+filename and the SHA-256 of its content. Journals of past days are final, so
+a multi-day merge (e.g., "Recent 7 Days") fetches only the latest journal,
+re-parses it only if its content has changed, and combines the cached
+sections of the other days. An entry cached while its journal was the latest
+is checked once more (by the hash) after the day has passed.
+"""
+__author__ = "York <york.jong@gmail.com>"
+__date__ = "2026/10/19 (initial version) ~ 2026/10/19 (last revision)"
+
+__all__ = [
+    'JournalCache',
+]
+
+import os
+import json
+import hashlib
+
+import clip
+from news_index import NewsIndex
+
+
+class JournalCache:
+    '''Cache of parsed journals in a local directory.
+    '''
+    def __init__(self, path=None):
+        '''Open a journal cache.
+
+        Args:
+            path (str): the cache directory; $JOURNAL_CACHE or
+                ~/.cache/news-digest-line/journals if None.
+        '''
+        self.path = path or os.environ.get('JOURNAL_CACHE') or \
+            os.path.expanduser('~/.cache/news-digest-line/journals')
+        os.makedirs(self.path, exist_ok=True)
+        self.fetched = 0    # journals fetched
+        self.parsed = 0     # journals parsed
+
+    def _entry_path(self, filename):
+        return os.path.join(self.path, f'{filename}.json')
+
+    def _read(self, filename):
+        '''Read a cache entry.
+
+        Args:
+            filename (str): the filename of the journal.
+
+        Returns:
+            (dict): the entry ({'sha256': str, 'latest': bool, 'sections':
+                {str: [str]}}), or None if not cached.
+        '''
+        try:
+            with open(self._entry_path(filename), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, filename, entry):
+        path = self._entry_path(filename)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def sections(self, filename, final=True):
+        '''Get the category sections of a journal.
+
+        Args:
+            filename (str): the filename of the journal (e.g.,
+                "2023_05_12.md").
+            final (bool): True if the journal will not change (a past day),
+                so a cached entry is used without fetching the journal,
+                unless it was cached while the journal was the latest.
+
+        Returns:
+            ({str: [str]}): map a category to its lines (the heading and
+                hashtags kept).
+        '''
+        entry = self._read(filename)
+        if entry is not None and final and not entry.get('latest'):
+            return entry['sections']
+
+        content = clip.get_journal(filename)
+        self.fetched += 1
+        digest = hashlib.sha256(content.encode()).hexdigest()
+        if entry is not None and entry['sha256'] == digest:
+            if final and entry.get('latest'):
+                # revalidated once the day has passed
+                entry['latest'] = False
+                self._write(filename, entry)
+            return entry['sections']
+
+        sections = NewsIndex(content).sections
+        self.parsed += 1
+        self._write(filename, {'sha256': digest, 'latest': not final,
+                               'sections': sections})
+        return sections
+
+    def index(self, filenames, latest=None):
+        '''Build the index of merged journals.
+
+        Sections of the same category are merged with the newest journal
+        first; the heading (the first line of a section) is kept once.
+
+        Args:
+            filenames ([str]): filenames of journals from the oldest to the
+                newest.
+            latest (str): the filename of the journal of today, which may
+                still change and is always checked.
+
+        Returns:
+            (NewsIndex): the index of the merged journals.
+        '''
+        merged = {}
+        for fn in reversed(filenames):
+            for c, lines in self.sections(fn, final=(fn != latest)).items():
+                if c in merged:
+                    merged[c] += lines[1:]
+                else:
+                    merged[c] = list(lines)
+        return NewsIndex(sections=merged)
+
+    def recent(self, days):
+        '''Build the index of journals of recent days.
+
+        Args:
+            days (int): the number of days.
+
+        Returns:
+            (NewsIndex): the index of the merged journals.
+        '''
+        fns = clip.get_recent_journal_filenames(days)
+        return self.index(fns, latest=fns[-1])
@@ -2,16 +2,29 @@
 Line Notify.
 """
 __author__ = "York <york.jong@gmail.com>"
-__date__ = "2023/03/23 (initial version) ~ 2023/05/10 (last revision)"
+__date__ = "2023/03/23 (initial version) ~ 2026/10/19 (last revision)"
 
 __all__ = [
     'notify_message',
     'token_status',
     'is_invalid_token',
+    'is_rate_limited',
 ]
 
+import time
+
 import requests
 
+import timing
+import metrics
+
+
+# map an access token to (remaining, reset) from the X-RateLimit-* headers
+# of Line Notify, where reset is the epoch time when the limit is reset. It
+# can be replaced with a shared dict (e.g., multiprocessing.Manager().dict())
+# so that processes sending with the same tokens share the state.
+rate_limits = {}
+
 
 #------------------------------------------------------------------------------
 # Utility Functions
@@ -74,7 +87,10 @@ def token_status(token):
         'Authorization': f'Bearer {token}'
     }
 
-    resp = requests.get(url, headers=headers)
+    with timing.call('line'):
+        resp = requests.get(url, headers=headers)
+    metrics.counter('line_token_status_requests_total',
+                    status=resp.status_code)
     try:
         return resp.json()
     except JSONDecodeError:
@@ -94,6 +110,42 @@ def is_invalid_token(token):
     return token_status(token).get('status') == 401
 
 
+#------------------------------------------------------------------------------
+# Rate Limits
+#------------------------------------------------------------------------------
+
+def _update_rate_limit(token, headers):
+    '''Update the rate-limit state of a token from response headers.
+
+    Args:
+        token (str): line access token
+        headers (dict): headers of a response of Line Notify.
+    '''
+    remaining = headers.get('X-RateLimit-Remaining')
+    reset = headers.get('X-RateLimit-Reset')
+    if remaining is None or reset is None:
+        return
+    try:
+        rate_limits[token] = (int(remaining), int(reset))
+    except ValueError:
+        pass
+
+
+def is_rate_limited(token, now=None):
+    '''Check if a token has used up its API calls until the limit is reset.
+
+    Args:
+        token (str): line access token
+        now (float): the current time (epoch seconds); time.time() if None.
+
+    Returns:
+        (bool): True if a call with the token would be rejected (429).
+    '''
+    remaining, reset = rate_limits.get(token, (1, 0))
+    now = time.time() if now is None else now
+    return remaining <= 0 and now < reset
+
+
 #------------------------------------------------------------------------------
 # Line Notify
 #------------------------------------------------------------------------------
@@ -107,7 +159,15 @@ def notify(msg, token):
     Args:
         msg (str): message to send
         token (str): line access token
+
+    Returns:
+        (int): the HTTP status code (e.g., 200, 401, 429); 429 without a
+            request if the token is rate limited (see is_rate_limited).
     '''
+    if is_rate_limited(token):
+        metrics.counter('line_notify_rate_limited_total')
+        return 429
+
     url = "https://notify-api.line.me/api/notify"
     headers = {
         "Authorization": "Bearer " + token,
@@ -116,7 +176,12 @@ def notify(msg, token):
     payload = {'message': msg}
 
     # send the message
-    r = requests.post(url, headers=headers, params=payload)
+    with timing.call('line'), metrics.timer('line_notify_request_seconds'):
+        r = requests.post(url, headers=headers, params=payload)
+    metrics.counter('line_notify_requests_total', status=r.status_code)
+    metrics.counter('line_notify_bytes_total', len(msg.encode()))
+    _update_rate_limit(token, r.headers)
+    return r.status_code
 
 
 def notify_message(msg, token, max_chars=1000):
@@ -132,10 +197,12 @@ def notify_message(msg, token, max_chars=1000):
         msg (str): message to send
         token (str): line access token
         max_chars (int): The maximum number of characters per sub-message.
+
+    Returns:
+        ([int]): the HTTP status codes of the sub-messages.
     '''
     msgs = split_string(msg, max_chars)
-    for m in msgs:
-        notify(f'\n{m}', token)
+    return [notify(f'\n{m}', token) for m in msgs]
 
 
 #------------------------------------------------------------------------------
@@ -0,0 +1,450 @@
+"""
+The module implement process-wide metrics: counters and latency histograms.
+
+Unlike timing, which traces a single request, metrics accumulate over the
+whole process (e.g., a dispatch run), and can be exported as the Prometheus
+text format or as a JSON report. Metrics are identified by a name and a set
+of labels:
+
+    metrics.counter('line_notify_requests_total', status=200)
+    metrics.observe('drive_request_seconds', 0.12, op='get')
+    with metrics.timer('dispatch_split_seconds'):
+        ...
+
+A Sampler profiles all threads of the process by sampling their stacks, so
+work run on thread pools (e.g., splitting and sending in dispatch) shows up,
+which cProfile (profiling only the calling thread) misses.
+"""
+__author__ = "York <york.jong@gmail.com>"
+__date__ = "2026/10/19 (initial version) ~ 2026/10/19 (last revision)"
+
+__all__ = [
+    'Registry',
+    'REGISTRY',
+    'counter',
+    'observe',
+    'timer',
+    'snapshot',
+    'merge',
+    'reset',
+    'prometheus',
+    'report',
+    'write',
+    'Sampler',
+]
+
+import os
+import sys
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+# default upper bounds of histogram buckets (seconds), as of Prometheus
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# help texts of the metrics (also fixing their order in exports)
+HELP = {
+    'line_notify_requests_total': 'Line Notify requests by HTTP status.',
+    'line_notify_bytes_total': 'Bytes of messages sent to Line Notify.',
+    'line_notify_request_seconds': 'Latency of Line Notify requests.',
+    'line_notify_rate_limited_total':
+        'Line Notify requests skipped as the token is rate limited.',
+    'line_token_status_requests_total':
+        'Token status requests by HTTP status.',
+    'drive_requests_total': 'Google Drive API requests by operation.',
+    'drive_request_seconds': 'Latency of Google Drive API requests.',
+    'drive_cache_hits_total': 'YAML loads served from the content cache.',
+    'dispatch_stage_seconds': 'Elapsed time of dispatch stages.',
+    'dispatch_filter_seconds': 'Time to filter the news of a row.',
+    'dispatch_render_seconds': 'Time to render the message of a row.',
+    'dispatch_split_seconds': 'Time to split a message into chunks.',
+    'dispatch_chunks_per_recipient': 'Requests (chunks) per recipient.',
+}
+
+# buckets of histograms which are not latencies
+HISTOGRAM_BUCKETS = {
+    'dispatch_chunks_per_recipient': (1, 2, 3, 5, 10, 20, 50, 100),
+}
+
+
+def _key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+def _format_number(x):
+    return repr(float(x)) if isinstance(x, float) else str(x)
+
+
+class Registry:
+    '''Counters and histograms of a process.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}     # map (name, labels) to value
+        self._histograms = {}   # map (name, labels) to [counts, sum, count]
+
+    def counter(self, name, value=1, **labels):
+        '''Increase a counter.
+
+        Args:
+            name (str): the metric name (e.g., "line_notify_requests_total").
+            value (float): the increment.
+            labels: the labels (e.g., status=200).
+        '''
+        key = (name, _key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        '''Observe a value of a histogram.
+
+        Args:
+            name (str): the metric name (e.g., "drive_request_seconds").
+            value (float): the value.
+            labels: the labels (e.g., op="get").
+        '''
+        buckets = HISTOGRAM_BUCKETS.get(name, BUCKETS)
+        key = (name, _key(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [[0] * len(buckets), 0, 0]
+            i = bisect_left(buckets, value)
+            if i < len(buckets):
+                hist[0][i] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def snapshot(self, reset=False):
+        '''Take a snapshot of the metrics (e.g., to send to another process).
+
+        Args:
+            reset (bool): True to reset the metrics after the snapshot.
+
+        Returns:
+            (dict): the snapshot (see merge).
+        '''
+        with self._lock:
+            snap = {
+                'counters': [[name, list(labels), value] for
+                             (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(counts), total, n]
+                               for (name, labels), (counts, total, n)
+                               in self._histograms.items()],
+            }
+            if reset:
+                self._counters = {}
+                self._histograms = {}
+        return snap
+
+    def merge(self, snap):
+        '''Add a snapshot (e.g., of a worker process) to the metrics.
+
+        Args:
+            snap (dict): the snapshot taken by snapshot().
+        '''
+        with self._lock:
+            for name, labels, value in snap['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                self._counters[key] = self._counters.get(key, 0) + value
+            for name, labels, counts, total, n in snap['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                hist = self._histograms.get(key)
+                if hist is None:
+                    hist = self._histograms[key] = [[0] * len(counts), 0, 0]
+                hist[0] = [a + b for a, b in zip(hist[0], counts)]
+                hist[1] += total
+                hist[2] += n
+
+    def reset(self):
+        '''Reset all metrics.
+        '''
+        self.snapshot(reset=True)
+
+    def _sorted(self, items):
+        order = {name: i for i, name in enumerate(HELP)}
+        return sorted(items, key=lambda kv: (order.get(kv[0][0], len(order)),
+                                             kv[0]))
+
+    def prometheus(self):
+        '''Export the metrics as the Prometheus text format.
+
+        Returns:
+            (str): the metrics.
+        '''
+        out = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in HELP:
+                    out.append(f'# HELP {name} {HELP[name]}')
+                out.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            counters = self._sorted(self._counters.items())
+            histograms = self._sorted(
+                (k, (list(c), s, n))
+                for k, (c, s, n) in self._histograms.items())
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            out.append(f'{name}{_format_labels(labels)} '
+                       f'{_format_number(value)}')
+        for (name, labels), (counts, total, n) in histograms:
+            header(name, 'histogram')
+            buckets = HISTOGRAM_BUCKETS.get(name, BUCKETS)
+            cumulative = 0
+            for le, count in zip(buckets, counts):
+                cumulative += count
+                le_label = [('le', _format_number(le))]
+                out.append(f'{name}_bucket{_format_labels(labels, le_label)}'
+                           f' {cumulative}')
+            inf_label = [('le', '+Inf')]
+            out.append(f'{name}_bucket{_format_labels(labels, inf_label)}'
+                       f' {n}')
+            out.append(f'{name}_sum{_format_labels(labels)} '
+                       f'{_format_number(total)}')
+            out.append(f'{name}_count{_format_labels(labels)} {n}')
+        return '\n'.join(out) + '\n'
+
+    def report(self):
+        '''Export the metrics as a JSON-serializable report.
+
+        Returns:
+            (dict): map a metric name to its samples; a histogram sample has
+                the count, the sum, the mean, and the counts of the buckets
+                (not cumulative) by upper bounds.
+        '''
+        result = {}
+        with self._lock:
+            counters = self._sorted(self._counters.items())
+            histograms = self._sorted(
+                (k, (list(c), s, n))
+                for k, (c, s, n) in self._histograms.items())
+        for (name, labels), value in counters:
+            result.setdefault(name, {'type': 'counter', 'samples': []})
+            result[name]['samples'].append(
+                {'labels': dict(labels), 'value': value})
+        for (name, labels), (counts, total, n) in histograms:
+            result.setdefault(name, {'type': 'histogram', 'samples': []})
+            buckets = HISTOGRAM_BUCKETS.get(name, BUCKETS)
+            result[name]['samples'].append({
+                'labels': dict(labels), 'count': n, 'sum': total,
+                'mean': total / n if n else 0,
+                'buckets': {str(le): c for le, c in zip(buckets, counts)},
+            })
+        return result
+
+
+# the registry of the process
+REGISTRY = Registry()
+
+
+#------------------------------------------------------------------------------
+# Shortcuts of the Process Registry
+#------------------------------------------------------------------------------
+
+def counter(name, value=1, **labels):
+    REGISTRY.counter(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+
+@contextmanager
+def timer(name, **labels):
+    '''Observe the elapsed time (seconds) of a block of code.
+
+    Args:
+        name (str): the histogram name.
+        labels: the labels.
+    '''
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.observe(name, time.perf_counter() - t0, **labels)
+
+
+def snapshot(reset=False):
+    return REGISTRY.snapshot(reset)
+
+
+def merge(snap):
+    REGISTRY.merge(snap)
+
+
+def reset():
+    REGISTRY.reset()
+
+
+def prometheus():
+    return REGISTRY.prometheus()
+
+
+def report():
+    return REGISTRY.report()
+
+
+def write(path):
+    '''Write the metrics to a file.
+
+    Args:
+        path (str): the file path; the Prometheus text format if it ends
+            with ".prom" or ".txt", or a JSON report otherwise.
+    '''
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.endswith(('.prom', '.txt')):
+            f.write(prometheus())
+        else:
+            json.dump(report(), f, indent=2)
+
+
+#------------------------------------------------------------------------------
+# Sampling Profiler
+#------------------------------------------------------------------------------
+
+class Sampler:
+    '''Sampling profiler of all threads of the process.
+
+    Usage:
+        with Sampler() as sampler:
+            ...
+        print(sampler.summary())
+        sampler.write('profile.folded')
+    '''
+    def __init__(self, interval=0.005):
+        '''
+        Args:
+            interval (float): the sampling interval in seconds.
+        '''
+        self.interval = interval
+        self.stacks = {}    # map a stack ("file:func;...", root first) to
+                            # its number of samples
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        me = threading.get_ident()
+        for tid, frame in sys._current_frames().items():
+            if tid == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:'
+                             f'{code.co_name}')
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def top(self, n=15):
+        '''Get the functions with the most samples.
+
+        Args:
+            n (int): the number of functions.
+
+        Returns:
+            ([(str, int, int)]): (function, self samples, total samples)
+                sorted by self samples, where self samples are samples with
+                the function on the top of the stack.
+        '''
+        own = {}
+        total = {}
+        for stack, count in self.stacks.items():
+            funcs = stack.split(';')
+            own[funcs[-1]] = own.get(funcs[-1], 0) + count
+            for func in set(funcs):
+                total[func] = total.get(func, 0) + count
+        ranked = sorted(own, key=own.get, reverse=True)[:n]
+        return [(func, own[func], total[func]) for func in ranked]
+
+    def summary(self, n=15):
+        '''Format the functions with the most samples.
+
+        Args:
+            n (int): the number of functions.
+
+        Returns:
+            (str): the summary.
+        '''
+        n_stacks = sum(self.stacks.values()) or 1
+        lines = [f'profile: {self.samples} samples every '
+                 f'{self.interval * 1000:g}ms (all threads)',
+                 f'{"self":>7} {"total":>7}  function']
+        for func, own, total in self.top(n):
+            lines.append(f'{own / n_stacks:>7.1%} {total / n_stacks:>7.1%}'
+                         f'  {func}')
+        return '\n'.join(lines)
+
+    def write(self, path):
+        '''Write the samples as collapsed stacks (e.g., for flamegraph.pl or
+        speedscope).
+
+        Args:
+            path (str): the file path.
+        '''
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f'{stack} {count}\n')
+
+
+#------------------------------------------------------------------------------
+# Test
+#------------------------------------------------------------------------------
+
+def test():
+    registry = Registry()
+    registry.counter('line_notify_requests_total', status=200)
+    registry.counter('line_notify_requests_total', 2, status=200)
+    registry.counter('line_notify_requests_total', status=401)
+    for x in (0.003, 0.02, 0.02, 20):
+        registry.observe('line_notify_request_seconds', x)
+    other = Registry()
+    other.merge(registry.snapshot())
+    other.merge(registry.snapshot(reset=True))
+    assert not registry.report()
+    text = other.prometheus()
+    assert 'line_notify_requests_total{status="200"} 6' in text
+    assert 'line_notify_request_seconds_bucket{le="0.025"} 6' in text
+    assert 'line_notify_request_seconds_bucket{le="+Inf"} 8' in text
+    print(text)
+    print(json.dumps(other.report(), indent=2))
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,148 @@
+"""
+The module implement an index over the content of news for dispatch.
+
+Without the index, every subscription row re-scans the whole content with
+clip and hashtag. The index splits the content into category sections once
+and indexes lines of each section by hashtags on demand, so a row resolves
+by look-ups and set unions, and only the lines of the row are passed to
+clip for the final formatting.
+"""
+__author__ = "York <york.jong@gmail.com>"
+__date__ = "2026/10/19 (initial version) ~ 2026/10/19 (last revision)"
+
+__all__ = [
+    'NewsIndex',
+]
+
+import clip
+import hashtag
+
+
+def _positions(lines, matched):
+    '''Find positions of matched lines in the lines.
+
+    Args:
+        lines ([str]): the lines.
+        matched ([str]): a subsequence of the lines (e.g., filtered by
+            hashtags).
+
+    Returns:
+        (set): the positions (line IDs).
+    '''
+    ids = set()
+    i = 0
+    for m in matched:
+        while i < len(lines) and lines[i] != m:
+            i += 1
+        if i == len(lines):
+            break
+        ids.add(i)
+        i += 1
+    return ids
+
+
+def _split_sections(content):
+    '''Split content into category sections in one pass.
+
+    A line is a heading if clip finds a category in it, and a section is the
+    lines from its heading to the next heading. Each section is formatted by
+    clip on its own, so the whole content is scanned once instead of once
+    per category.
+
+    Args:
+        content (str): the content (markdown) of the news.
+
+    Returns:
+        ({str: [str]}): map a category to its lines (the heading and hashtags
+            kept) in the order of the content.
+    '''
+    chunks = {}     # map category to its raw lines
+    current = None
+    for line in content.split('\n'):
+        found = clip.get_categories(line)
+        if found:
+            current = chunks.setdefault(found[0], [])
+        if current is not None:
+            current.append(line)
+    return {c: clip.get_lines_of_categories([c], '\n'.join(lines), True, True)
+            for c, lines in chunks.items()}
+
+
+class NewsIndex:
+    '''Index of the content of news: category -> lines (with the heading and
+    hashtags), and (hashtag, category) -> line IDs.
+    '''
+    def __init__(self, content=None, sections=None):
+        '''Build the index from content or from category sections.
+
+        Args:
+            content (str): the content (markdown) of the news.
+            sections ({str: [str]}): map a category to its lines (the heading
+                and hashtags kept) in the order of the content; used instead
+                of content if specified.
+        '''
+        if sections is None:
+            sections = _split_sections(content)
+        self.sections = sections
+        self._tag_ids = {}  # map (tag, category) to line IDs
+
+    @property
+    def categories(self):
+        '''([str]): categories in the order of the content.'''
+        return list(self.sections)
+
+    def _ids(self, tag, category):
+        '''Get IDs of lines of a category with a hashtag.
+
+        Args:
+            tag (str): the hashtag (e.g., "#AI").
+            category (str): the category.
+
+        Returns:
+            (set): IDs of the lines.
+        '''
+        key = (tag, category)
+        if key not in self._tag_ids:
+            lines = self.sections[category]
+            matched = hashtag.get_lines_with_any_hashtags(lines, [tag])
+            self._tag_ids[key] = _positions(lines, matched)
+        return self._tag_ids[key]
+
+    def lines(self, topics, show_headings=True):
+        '''Get lines of news subscribed with a topic row.
+
+        The result is the same as filtering the whole content with clip and
+        hashtag: for hashtags, the lines of the categories (all categories if
+        no heading is given) with any of the hashtags; otherwise, the lines
+        of the categories.
+
+        Args:
+            topics ([str]): headings (categories) and hashtags (starting with
+                '#') of a subscription row.
+            show_headings (bool): True to keep headings of categories.
+
+        Returns:
+            ([str]): the lines.
+        '''
+        headings = [topic for topic in topics if not topic.startswith('#')]
+        tags = [topic for topic in topics if topic.startswith('#')]
+        categories = headings
+        if not categories and tags:
+            categories = self.categories
+        wanted = set(categories)
+        ordered = [c for c in self.sections if c in wanted]
+
+        if tags:
+            parts = []
+            for c in ordered:
+                ids = set().union(*(self._ids(t, c) for t in tags))
+                lines = self.sections[c]
+                parts += [lines[i] for i in sorted(ids)]
+            with_headings = True if headings and show_headings else False
+        else:
+            parts = [line for c in ordered for line in self.sections[c]]
+            with_headings = show_headings
+        if not parts:
+            return []
+        return clip.get_lines_of_categories(
+            categories, '\n'.join(parts), False, with_headings)
@@ -0,0 +1,352 @@
+"""
+The module implement a scheduler spreading deliveries over a time window.
+
+Line Notify allows a fixed number of API calls per token per hour, and a
+burst of all deliveries at dispatch time causes latency spikes on the shared
+egress and clustered 429s. The scheduler releases deliveries (the messages of
+a recipient, sent in order) at a steady pace so that the last one is released
+before the deadline (the end of the window), recipients of a higher priority
+(e.g., groups) first. The pace is recomputed at each release from the time and
+the deliveries left, so slow sends or a late start speed it up instead of
+missing the deadline.
+"""
+__author__ = "York <york.jong@gmail.com>"
+__date__ = "2026/10/19 (initial version) ~ 2026/10/19 (last revision)"
+
+__all__ = [
+    'GROUP',
+    'USER',
+    'UNKNOWN',
+    'priority_of',
+    'fetch_statuses',
+    'TargetTypes',
+    'Delivery',
+    'Progress',
+    'SpreadScheduler',
+]
+
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import line
+
+
+# priorities of recipients (the smaller, the earlier)
+GROUP = 0
+USER = 1
+UNKNOWN = 2
+
+
+#------------------------------------------------------------------------------
+# Priorities
+#------------------------------------------------------------------------------
+
+def priority_of(status):
+    '''Get the priority of a recipient from its token status.
+
+    Args:
+        status (dict): the token status (see line.token_status).
+
+    Returns:
+        (int): GROUP, USER, or UNKNOWN.
+    '''
+    return {'GROUP': GROUP, 'USER': USER}.get(status.get('targetType'),
+                                              UNKNOWN)
+
+
+def fetch_statuses(tokens, workers=2):
+    '''Fetch the statuses of tokens in parallel.
+
+    A status call counts against the rate limit of the token, so only a few
+    calls are made at a time (see also TargetTypes).
+
+    Args:
+        tokens ([str]): the access tokens.
+        workers (int): the number of worker threads.
+
+    Returns:
+        ({str: dict}): map a token to its status (see line.token_status).
+    '''
+    tokens = list(dict.fromkeys(tokens))
+    if not tokens:
+        return {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(tokens, pool.map(line.token_status, tokens)))
+
+
+class TargetTypes:
+    '''Local cache of the target types ("USER" or "GROUP") of tokens.
+
+    The target type of a token never changes, so the status of a token is
+    fetched once, instead of at every dispatch. Tokens are keyed by a
+    truncated SHA-256, so the cache keeps no tokens.
+    '''
+    def __init__(self, path=None):
+        '''Open a cache of target types.
+
+        Args:
+            path (str): the cache file; $TARGET_TYPE_CACHE or
+                ~/.cache/news-digest-line/target_types.json if None.
+        '''
+        self.path = path or os.environ.get('TARGET_TYPE_CACHE') or \
+            os.path.expanduser('~/.cache/news-digest-line/target_types.json')
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self._types = json.load(f)
+        except (OSError, ValueError):
+            self._types = {}
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+    def get(self, token):
+        '''Get the target type of a token.
+
+        Args:
+            token (str): the access token.
+
+        Returns:
+            (str): the target type; None if not cached.
+        '''
+        return self._types.get(self._key(token))
+
+    def update(self, statuses):
+        '''Cache the target types of valid tokens.
+
+        Args:
+            statuses ({str: dict}): map a token to its status (see
+                fetch_statuses).
+        '''
+        for token, status in statuses.items():
+            if status.get('status') == 200 and status.get('targetType'):
+                self._types[self._key(token)] = status['targetType']
+
+    def save(self):
+        '''Save the cache.
+        '''
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._types, f)
+        os.replace(tmp, self.path)
+
+
+#------------------------------------------------------------------------------
+# Scheduling
+#------------------------------------------------------------------------------
+
+class Delivery:
+    '''The messages to send to a recipient.
+    '''
+    def __init__(self, client, token, msgs, priority=UNKNOWN):
+        '''
+        Args:
+            client (str): the client name of the recipient.
+            token (str): the access token of the recipient.
+            msgs ([str]): the messages, sent in order.
+            priority (int): the priority (e.g., GROUP or USER).
+        '''
+        self.client = client
+        self.token = token
+        self.msgs = msgs
+        self.priority = priority
+
+
+class Progress:
+    '''Progress of a scheduled run.
+    '''
+    def __init__(self, total, start, deadline):
+        self.total = total      # deliveries
+        self.released = 0       # deliveries released to the senders
+        self.done = 0           # deliveries finished
+        self.failed = 0         # deliveries with an error or a non-200 status
+        self.requests = 0       # HTTP requests
+        self.start = start
+        self.deadline = deadline
+        self.gap = 0            # the current gap (s) between releases
+        self._lock = threading.Lock()
+
+    def finish(self, statuses, error=None):
+        '''Count a finished delivery.
+
+        Args:
+            statuses ([int]): HTTP status codes of its requests (None in a
+                dry run).
+            error (Exception): the error raised by the sender, if any.
+        '''
+        with self._lock:
+            self.done += 1
+            self.requests += len(statuses)
+            if error is not None or \
+                    any(s is not None and s != 200 for s in statuses):
+                self.failed += 1
+
+    def summary(self, now):
+        '''Format the progress.
+
+        Args:
+            now (float): the current time (of the clock of the scheduler).
+
+        Returns:
+            (str): the summary of the progress.
+        '''
+        pct = self.done / self.total if self.total else 1
+        left = self.deadline - now
+        due = f'{left:.0f}s to deadline' if left >= 0 else \
+            f'{-left:.0f}s past deadline'
+        return (f'progress: {self.done}/{self.total} done ({pct:.0%}), '
+                f'{self.released} released, {self.failed} failed, '
+                f'{self.requests} requests, elapsed {now - self.start:.0f}s, '
+                f'{due}, gap {self.gap:.2f}s')
+
+
+class SpreadScheduler:
+    '''Scheduler releasing deliveries at a steady pace over a time window.
+    '''
+    def __init__(self, window, workers=8, report_every=60, send=None,
+                 clock=time.monotonic, sleep=time.sleep, out=print):
+        '''
+        Args:
+            window (float): the time window (in seconds) to spread the
+                deliveries over; 0 to release them all at once.
+            workers (int): the number of sender threads.
+            report_every (float): the interval (in seconds) of progress
+                reports; 0 for no periodic report.
+            send (callable): send a Delivery and return its statuses; sending
+                each message with line.notify_message if None.
+            clock (callable): the clock (in seconds).
+            sleep (callable): the sleep function.
+            out (callable): the function printing progress reports; None for
+                no report.
+        '''
+        self.window = window
+        self.workers = workers
+        self.report_every = report_every
+        self._send = send or self._notify
+        self._clock = clock
+        self._sleep = sleep
+        self._out = out
+
+    @staticmethod
+    def _notify(delivery):
+        statuses = []
+        for msg in delivery.msgs:
+            statuses += line.notify_message(msg, delivery.token)
+        return statuses
+
+    def _report(self, progress, now):
+        if self._out is not None:
+            self._out(progress.summary(now))
+
+    def _wait(self, until, progress):
+        '''Wait until a time, reporting the progress periodically.
+
+        Args:
+            until (float): the time (of the clock).
+            progress (Progress): the progress.
+        '''
+        while True:
+            now = self._clock()
+            if self.report_every and now >= self._next_report:
+                self._report(progress, now)
+                self._next_report = now + self.report_every
+            if now >= until:
+                return
+            wake = until
+            if self.report_every:
+                wake = min(wake, self._next_report)
+            self._sleep(wake - now)
+
+    def run(self, deliveries, statuses=None):
+        '''Send deliveries spread over the window.
+
+        Deliveries are released by priority (in the given order within a
+        priority). Each release waits for the time left to the deadline
+        divided by the deliveries left.
+
+        Args:
+            deliveries ([Delivery]): the deliveries.
+            statuses (callable): map the result of send to the HTTP status
+                codes of its requests; the result itself if None.
+
+        Returns:
+            ([(Delivery, object, Exception)], Progress): (delivery, result
+                of send, error) of each delivery in the order of release,
+                and the progress.
+        '''
+        order = sorted(deliveries, key=lambda d: d.priority)
+        start = self._clock()
+        progress = Progress(len(order), start, start + self.window)
+        self._next_report = start + self.report_every
+        to_statuses = statuses or (lambda result: result)
+
+        def done(future):
+            error = future.exception()
+            progress.finish([] if error else to_statuses(future.result()),
+                            error)
+
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for i, delivery in enumerate(order):
+                future = pool.submit(self._send, delivery)
+                future.add_done_callback(done)
+                futures.append(future)
+                progress.released += 1
+                left = len(order) - i - 1
+                if not left:
+                    break
+                # spread the deliveries left over the time left
+                now = self._clock()
+                progress.gap = max(0, progress.deadline - now) / (left + 1)
+                self._wait(now + progress.gap, progress)
+            while not all(f.done() for f in futures):
+                self._wait(self._clock() + 0.1, progress)
+
+        self._report(progress, self._clock())
+        results = []
+        for delivery, future in zip(order, futures):
+            error = future.exception()
+            results.append((delivery, None if error else future.result(),
+                            error))
+        return results, progress
+
+
+#------------------------------------------------------------------------------
+# Test
+#------------------------------------------------------------------------------
+
+def test():
+    import tempfile
+    sent = []
+
+    def send(delivery):
+        sent.append((delivery.client, round(time.monotonic() - t0, 1)))
+        return [200] * len(delivery.msgs)
+
+    deliveries = [Delivery(f'user{i}', '', ['a'], USER) for i in range(3)]
+    deliveries.insert(1, Delivery('group', '', ['a', 'b'], GROUP))
+    scheduler = SpreadScheduler(2, workers=1, report_every=1, send=send)
+    t0 = time.monotonic()
+    results, progress = scheduler.run(deliveries)
+    assert [c for c, _ in sent] == ['group', 'user0', 'user1', 'user2']
+    assert [t for _, t in sent] == [0, 0.5, 1.0, 1.5], sent
+    assert progress.done == 4 and progress.requests == 5
+    assert priority_of({'targetType': 'GROUP'}) == GROUP
+
+    with tempfile.TemporaryDirectory() as path:
+        types = TargetTypes(os.path.join(path, 'types.json'))
+        types.update({'A': {'status': 200, 'targetType': 'GROUP'},
+                      'B': {'status': 401, 'message': 'Invalid access token'}})
+        types.save()
+        types = TargetTypes(types.path)
+        assert types.get('A') == 'GROUP' and types.get('B') is None
+    print('OK')
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,267 @@
+"""
+The module implement the subscription page shared by the subscribe and the
+oauth serverless functions.
+"""
+__author__ = "York <york.jong@gmail.com>"
+__date__ = "2026/10/19 (initial version) ~ 2026/10/19 (last revision)"
+
+__all__ = [
+    'c',
+    'page_etag',
+    'start_loads',
+    'resolve_name',
+    'SubscriptionPage',
+]
+
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import timing
+from line import is_invalid_token
+from gdrive import Drive, TokenTable, Subscriptions, shard_filename
+
+
+# dict for comments to topics
+c = {
+    'IT': ' (AI, Software)',
+    '#AI': ', #robotics, #brain',
+}
+
+# files the page is rendered from
+PAGE_FILES = [
+    'access_tokens.yml',
+    'subscriptions_Daily.yml',
+    'subscriptions_Weekly.yml',
+]
+
+# revision of the page markup; bump it to invalidate ETags of cached pages.
+PAGE_REVISION = '1'
+
+# map filename of subscriptions to (version, options, index), where options
+# are precompiled (topic, head, tail) of <option> elements and index maps a
+# client to its subscribed topics.
+_fragments = {}
+
+
+#------------------------------------------------------------------------------
+# Loading
+#------------------------------------------------------------------------------
+
+def page_etag(token):
+    '''Make the entity tag of the page of a token before loading any content.
+
+    The tag is made from the metadata versions of the files (or of all their
+    shards) the page is rendered from, so a conditional request is answered
+    without the token status call and without downloading the files.
+
+    Args:
+        token (str): the access token.
+
+    Returns:
+        (str): the (quoted) entity tag, or None if a file has no version
+            (e.g., versioning is disabled).
+    '''
+    fns = []
+    for fn in PAGE_FILES:
+        n = Drive().n_shards(fn)
+        fns += [shard_filename(fn, i) for i in range(n)] if n else [fn]
+    with ThreadPoolExecutor(max_workers=len(fns)) as pool:
+        versions = list(pool.map(timing.bind(Drive().version), fns))
+    if None in versions:
+        return None
+    return _etag(PAGE_REVISION, token,
+                 *[f'{fn}:{v}' for fn, v in zip(fns, versions)])
+
+
+def start_loads(pool):
+    '''Start loading the token table and the subscriptions on a thread pool.
+
+    All shards are loaded since the client may be unknown yet.
+
+    Args:
+        pool (ThreadPoolExecutor): the thread pool.
+
+    Returns:
+        (Future, Future, Future): futures of the TokenTable, the daily
+            Subscriptions, and the weekly Subscriptions.
+    '''
+    f_tbl = pool.submit(
+        timing.timed('load-tokens', TokenTable), 'access_tokens.yml')
+    f_subs_d = pool.submit(
+        timing.timed('load-daily', Subscriptions), 'subscriptions_Daily.yml')
+    f_subs_w = pool.submit(
+        timing.timed('load-weekly', Subscriptions), 'subscriptions_Weekly.yml')
+    return f_tbl, f_subs_d, f_subs_w
+
+
+def resolve_name(tbl, target, token):
+    '''Resolve the client name of a token.
+
+    If the target name is used by another token which is invalid now (e.g.,
+    the token has been regenerated), the target takes over the name and the
+    token table is saved.
+
+    Args:
+        tbl (TokenTable): the token table.
+        target (str): the target name from the token status.
+        token (str): the access token.
+
+    Returns:
+        (str): the client name.
+
+    Raises:
+        Exception: if the token table fails to be saved.
+    '''
+    with timing.phase('unique-name'):
+        name = tbl.gen_unique_name(target, token)
+    if name != target:
+        # check if the old token is invalid.
+        with timing.phase('old-token-status'):
+            invalid = is_invalid_token(tbl[target])
+        if invalid:
+            tbl[target] = token     # use new token
+            tbl.save()
+            name = target
+    return name
+
+
+#------------------------------------------------------------------------------
+# Rendering
+#------------------------------------------------------------------------------
+
+def _fragment(filename, subs, option):
+    '''Get the precompiled options and the client index of subscriptions.
+
+    The result is cached per version of the subscription file.
+
+    Args:
+        filename (str): the filename of the subscriptions.
+        subs (Subscriptions): the subscriptions loaded from the file.
+        option (callable): map a topic to the (head, tail) of its <option>
+            element; " selected" is inserted between them.
+
+    Returns:
+        ([(str, str, str)], {str: [str]}): the options and the index.
+    '''
+    version, options, index = _fragments.get(filename, (None, None, None))
+    if version is None or version != subs.version:
+        options = [(t, *option(t)) for t in subs.subscribable_topics()]
+        index = subs.index()
+        _fragments[filename] = (subs.version, options, index)
+    return options, index
+
+
+def _daily_option(t):
+    return (f'{" "*12}<option value="{t}"', f'>{t}{c.get(t, "")}</option>')
+
+
+def _weekly_option(t):
+    return (f'{" "*4}<option value="{t}"', f'>{t} (Weekly)</option>')
+
+
+def _render_options(options, selected):
+    '''Render precompiled options.
+
+    Args:
+        options ([(str, str, str)]): precompiled (topic, head, tail).
+        selected (set): the selected topics.
+
+    Returns:
+        (str): the <option> elements.
+    '''
+    return "\n".join(
+        f'{head}{" selected" if t in selected else ""}{tail}'
+        for t, head, tail in options)
+
+
+def _etag(*parts):
+    '''Make an entity tag from given parts.
+
+    Args:
+        parts (str): the parts identifying a page.
+
+    Returns:
+        (str): the (quoted) entity tag.
+    '''
+    digest = hashlib.sha1('\0'.join(parts).encode()).hexdigest()
+    return f'"{digest[:20]}"'
+
+
+class SubscriptionPage:
+    '''The subscription page of a client.
+    '''
+    def __init__(self, token, name, subs_d, subs_w):
+        '''Prepare the page from the loaded subscriptions.
+
+        Args:
+            token (str): the access token of the client.
+            name (str): the client name.
+            subs_d (Subscriptions): the daily subscriptions.
+            subs_w (Subscriptions): the weekly subscriptions.
+        '''
+        self.token = token
+        self.name = name
+        self._opts_d, index_d = _fragment(
+            'subscriptions_Daily.yml', subs_d, _daily_option)
+        self._opts_w, index_w = _fragment(
+            'subscriptions_Weekly.yml', subs_w, _weekly_option)
+        self._sel_d = set(index_d.get(name, []))
+        self._sel_w = set(index_w.get(name, []))
+
+    def html(self, location=None):
+        '''Render the page.
+
+        Args:
+            location (str): if specified, the URL shown in the address bar
+                (e.g., the bookmarkable subscribe URL when the page is
+                rendered by the OAuth callback).
+
+        Returns:
+            (str): the HTML of the page.
+        '''
+        token = self.token
+        name = self.name
+        options_daily = _render_options(self._opts_d, self._sel_d)
+        options_weekly = _render_options(self._opts_w, self._sel_w)
+        n_options = len(self._opts_d) + len(self._opts_w)
+        script = ''
+        if location:
+            script = (f"    <script>history.replaceState(null, '', "
+                      f"'{location}');</script>\n")
+
+        html = f"""
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>Subscription to news-digest (token: {token})</title>
+    <style>
+        #topics {{
+            height: auto;
+            max-height: 500px;
+            overflow-y: scroll;
+        }}
+    </style>
+{script}</head>
+<body>
+    <h1>Subscription to news-digest</h1>
+    <form method="post" action="/api/subscribe">
+        <label for="topics">請選取分類後按下訂閱（可複選）：</label><br/><br/>
+        <select name="topics" id="topics" multiple size="{n_options}">
+{options_daily}
+{options_weekly}
+        </select>
+        <input type="hidden" name="token" value="{token}">
+        <input type="hidden" name="target" value="{name}"><br/><br/>
+        <input type="submit" value="訂閱">
+    </form>
+    <ul>
+    <li><div style="background-color: #ffffcc; color: #000000; padding: 10px;">
+    請將此頁面加入書籤，以利後續更改訂閱主題
+    </div></li>
+    <li>"IT", "#AI..." 兩個分類的新聞有大量重複，建議擇一訂閱即可</li>
+    </ul>
+</body>
+</html>
+"""
+        return html
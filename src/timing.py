@@ -0,0 +1,309 @@
+"""
+The module implement per-request timing and tracing.
+
+A trace records durations of phases (e.g., "token-status", "render") and
+counts and durations of outbound calls (e.g., "line", "drive"). The trace of
+a request is emitted as a Server-Timing response header and, if the
+environment variable TIMING_LOG is set, as a JSON log line.
+"""
+__author__ = "York <york.jong@gmail.com>"
+__date__ = "2026/10/19 (initial version) ~ 2026/10/19 (last revision)"
+
+__all__ = [
+    'Trace',
+    'ServerTimingMixin',
+    'start',
+    'current',
+    'phase',
+    'call',
+    'bind',
+    'timed',
+]
+
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+
+#------------------------------------------------------------------------------
+# Trace
+#------------------------------------------------------------------------------
+
+class Trace:
+    '''Durations of phases and outbound calls of a request.
+    '''
+    def __init__(self, name):
+        '''Start a trace.
+
+        Args:
+            name (str): name of the trace (e.g., "GET /api/subscribe").
+        '''
+        self.name = name
+        self.phases = {}    # map phase name to duration (ms)
+        self.calls = {}     # map call name to [count, duration (ms)]
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()   # calls may come from worker threads
+
+    def elapsed(self):
+        '''Get the elapsed time since the trace started.
+
+        Returns:
+            (float): the elapsed time in milliseconds.
+        '''
+        return (time.perf_counter() - self._start) * 1000
+
+    def add_phase(self, name, ms):
+        '''Add a duration to a phase.
+
+        Args:
+            name (str): the phase name.
+            ms (float): the duration in milliseconds.
+        '''
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0) + ms
+
+    def add_call(self, name, ms):
+        '''Count an outbound call.
+
+        Args:
+            name (str): the call name (e.g., "line", "drive").
+            ms (float): the duration in milliseconds.
+        '''
+        with self._lock:
+            count, total = self.calls.get(name, (0, 0))
+            self.calls[name] = [count + 1, total + ms]
+
+    @contextmanager
+    def phase(self, name):
+        '''Time a block of code as a phase.
+
+        Args:
+            name (str): the phase name.
+        '''
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, (time.perf_counter() - t0) * 1000)
+
+    @contextmanager
+    def call(self, name):
+        '''Time a block of code as an outbound call.
+
+        Args:
+            name (str): the call name.
+        '''
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_call(name, (time.perf_counter() - t0) * 1000)
+
+    def server_timing(self):
+        '''Format the trace as the value of a Server-Timing header.
+
+        Returns:
+            (str): e.g., 'token-status;dur=85.2,
+                drive;dur=160.4;desc="3 calls", total;dur=310.9'.
+        '''
+        with self._lock:
+            metrics = [f'{name};dur={ms:.1f}'
+                       for name, ms in self.phases.items()]
+            metrics += [f'{name};dur={ms:.1f};desc="{count} calls"'
+                        for name, (count, ms) in self.calls.items()]
+        metrics.append(f'total;dur={self.elapsed():.1f}')
+        return ', '.join(metrics)
+
+    def to_dict(self):
+        '''Convert the trace to a dictionary.
+
+        Returns:
+            (dict): the trace.
+        '''
+        with self._lock:
+            return {
+                'name': self.name,
+                'total_ms': round(self.elapsed(), 1),
+                'phases_ms': {k: round(v, 1) for k, v in self.phases.items()},
+                'calls': {k: {'count': n, 'ms': round(ms, 1)}
+                          for k, (n, ms) in self.calls.items()},
+            }
+
+    def log(self, **fields):
+        '''Print the trace as a JSON line if TIMING_LOG is set.
+
+        Args:
+            fields: extra fields (e.g., status=200) of the log line.
+        '''
+        if not os.environ.get('TIMING_LOG'):
+            return
+        print(json.dumps({**self.to_dict(), **fields}), flush=True)
+
+
+#------------------------------------------------------------------------------
+# Current Trace
+#------------------------------------------------------------------------------
+
+# The trace of the current request is kept in a context variable, so requests
+# handled by different threads do not share a trace. Tasks on a thread pool do
+# not inherit the context; bind (or timed) carries the trace over to them.
+_current = contextvars.ContextVar('trace', default=None)
+
+
+def start(name):
+    '''Start a new trace as the current trace.
+
+    Args:
+        name (str): name of the trace.
+
+    Returns:
+        (Trace): the new trace.
+    '''
+    trace = Trace(name)
+    _current.set(trace)
+    return trace
+
+
+def current():
+    '''Get the current trace.
+
+    Returns:
+        (Trace): the current trace, or None if no trace is started.
+    '''
+    return _current.get()
+
+
+@contextmanager
+def phase(name):
+    '''Time a block of code as a phase of the current trace (no-op without a
+    current trace).
+
+    Args:
+        name (str): the phase name.
+    '''
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    with trace.phase(name):
+        yield
+
+
+@contextmanager
+def call(name):
+    '''Time a block of code as an outbound call of the current trace (no-op
+    without a current trace).
+
+    Args:
+        name (str): the call name.
+    '''
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    with trace.call(name):
+        yield
+
+
+def bind(func):
+    '''Bind a function to the current trace, so it records to the trace when
+    it runs on another thread (e.g., a task submitted to a thread pool).
+
+    Args:
+        func (callable): the function.
+
+    Returns:
+        (callable): the function running with the trace as its current trace.
+    '''
+    trace = _current.get()
+
+    def run(*args, **kwargs):
+        token = _current.set(trace)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+def timed(name, func):
+    '''Bind a function to the current trace and time each call of it as a
+    phase (e.g., a task submitted to a thread pool).
+
+    Args:
+        name (str): the phase name.
+        func (callable): the function.
+
+    Returns:
+        (callable): the timed function.
+    '''
+    def run(*args, **kwargs):
+        with phase(name):
+            return func(*args, **kwargs)
+    return bind(run)
+
+
+#------------------------------------------------------------------------------
+# HTTP Handler
+#------------------------------------------------------------------------------
+
+class ServerTimingMixin:
+    '''Mixin of BaseHTTPRequestHandler to trace each request.
+
+    A trace is started when a request is parsed. The Server-Timing header is
+    added and the JSON log line is written when the headers are ended.
+    '''
+    def parse_request(self):
+        ok = super().parse_request()
+        if ok:
+            start(f'{self.command} {urlparse(self.path).path}')
+        return ok
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def end_headers(self):
+        trace = current()
+        if trace is not None:
+            self.send_header('Server-Timing', trace.server_timing())
+            trace.log(status=getattr(self, '_status', None))
+        super().end_headers()
+
+
+#------------------------------------------------------------------------------
+# Test
+#------------------------------------------------------------------------------
+
+def test():
+    from concurrent.futures import ThreadPoolExecutor
+
+    trace = start('test')
+    with phase('sleep'):
+        time.sleep(0.01)
+    for _ in range(3):
+        with call('noop'):
+            pass
+
+    def noop():
+        with call('pool-noop'):
+            pass
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        pool.submit(noop).result()              # not bound: not recorded
+        pool.submit(timed('pool', noop)).result()
+        pool.submit(bind(noop)).result()
+        # a trace started on another thread is not the current trace here
+        other = pool.submit(start, 'other').result()
+    assert current() is trace and other is not trace
+    assert trace.calls['pool-noop'][0] == 2 and 'pool' in trace.phases
+    print(trace.server_timing())
+    os.environ['TIMING_LOG'] = '1'
+    trace.log(status=200)
+
+
+if __name__ == '__main__':
+    test()